@@ -1,22 +1,171 @@
 from tkinter import *
+from tkinter import filedialog
 from tkinter import messagebox
 from tkinter.ttk import *
 
 from smarthome.automation_system import *
 from smarthome.devices import *
+from smarthome.notifier import *
+from smarthome.scenario import *
 
 import threading
-import time
+
+'''
+View-model of a device block: remembers what was last rendered for its device,
+and only reconfigures the widgets whose fields changed
+'''
+class DeviceBlockView:
+    def __init__(self, gui, block):
+        self.gui = gui
+        self.block = block
+        self.device_name_label = Label(block)
+        self.toggle_button = Button(block, style='Red.TButton')
+        self.label_one = Label(block)
+        self.scale = Scale(block)
+        self.device = None
+        self.__rendered = {}
+
+    '''
+        Assigns a device to the block, binding the widgets' commands once
+    '''
+    def bind(self, device):
+        self.device = device
+        self.__rendered = {}
+        self.device_name_label.grid(row=0, column=0, sticky="w", padx=10, pady=10)
+        self.toggle_button.bind("<Button-1>", lambda event: self.gui.toggle_button_command(self.device))
+        self.toggle_button.grid(row=0, column=1, sticky="w", padx=10, pady=10)
+        self.label_one.grid(row=1, column=0, columnspan=2, sticky='w', padx=50, pady=5)
+
+        if isinstance(device, SmartLight):
+            self.scale.config(from_=SmartLight.MIN_BRIGHTNESS, to=SmartLight.MAX_BRIGHTNESS, orient="horizontal", length=300)
+            self.scale.bind("<ButtonRelease-1>", lambda event: self.gui.on_brightness_change(self.scale, self.device))
+            self.scale.grid(row=2, column = 0, columnspan = 2, sticky='w', padx=50, pady=5)
+        elif isinstance(device, Thermostat):
+            self.scale.config(from_=Thermostat.MIN_TEMP, to=Thermostat.MAX_TEMP, orient="horizontal", length=300)
+            self.scale.bind("<ButtonRelease-1>", lambda event: self.gui.on_temperature_change(self.scale, self.device))
+            self.scale.grid(row=2, column = 0, columnspan = 2, sticky='w', padx=50, pady=5)
+        else:
+            self.scale.grid_forget()
+
+    '''
+        Returns the fields of the device as they should be displayed, from its state in a snapshot
+    '''
+    def __fields(self, device_state):
+        status = device_state.status
+        state = {
+            'name': device_state.name,
+            'toggle_text': 'Toggle ON' if status == Status.OFF else 'Toggle OFF',
+            'toggle_style': 'Red.TButton' if status == Status.OFF else 'Green.TButton',
+        }
+        if isinstance(self.device, SmartLight):
+            state['label'] = f'Current brightness: {"0" if status==Status.OFF else device_state.brightness}%'
+            state['scale'] = device_state.brightness
+        elif isinstance(self.device, Thermostat):
+            state['label'] = f'Current temperature: {"Unknown" if status==Status.OFF else str(device_state.temperature) + "°C"}'
+            state['scale'] = device_state.temperature
+        elif isinstance(self.device, SecurityCamera):
+            state['label'] = f'Current security state: {"Unknown" if status == Status.OFF else device_state.security_status.name}'
+        return state
+
+    '''
+        Applies the fields which changed since the last render
+    '''
+    def render(self, device_state):
+        if device_state is None:
+            return
+        state = self.__fields(device_state)
+        changed = {field: value for field, value in state.items() if self.__rendered.get(field) != value}
+        if 'name' in changed:
+            self.device_name_label.config(text=changed['name'])
+        if 'toggle_text' in changed:
+            self.toggle_button.config(text=changed['toggle_text'])
+        if 'toggle_style' in changed:
+            self.toggle_button.config(style=changed['toggle_style'])
+        if 'label' in changed:
+            self.label_one.config(text=changed['label'])
+        if 'scale' in changed:
+            self.scale.set(changed['scale'])
+        self.__rendered = state
+
+'''
+View of a log row: only rewrites its label when the text changes
+'''
+class LogRowView:
+    def __init__(self, block):
+        self.label = Label(block, font=('Arial', 13))
+        self.label.pack(expand=True)
+        self.__text = None
+
+    def render(self, text):
+        if text != self.__text:
+            self.label.config(text=text)
+            self.__text = text
+
+'''
+Windowed list inside a canvas: only the rows visible in the viewport have widgets,
+and they are recycled for other items as the list is scrolled
+'''
+class VirtualList:
+    def __init__(self, canvas, scrollbar, width, row_height, create_row, show_row):
+        self.canvas = canvas
+        self.width = width
+        self.row_height = row_height
+        self.create_row = create_row
+        self.show_row = show_row
+        self.rows = []
+        self.count = 0
+        self.canvas.config(yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.scroll)
+        self.canvas.bind('<Configure>', lambda event: self.layout())
+
+    '''
+        Sets the number of items in the list
+    '''
+    def set_count(self, count):
+        self.count = count
+        self.canvas.config(scrollregion=(0, 0, self.width, count * self.row_height))
+        self.layout()
+
+    '''
+        Scrollbar command: scrolls the canvas, then shows the items which became visible
+    '''
+    def scroll(self, *args):
+        self.canvas.yview(*args)
+        self.layout()
+
+    '''
+        Positions the row widgets over the visible items, creating widgets only if the viewport grew
+    '''
+    def layout(self):
+        visible = max(1, self.canvas.winfo_height() // self.row_height + 2)
+        while len(self.rows) < visible:
+            block = Frame(self.canvas, width=self.width, height=self.row_height)
+            view = self.create_row(block)
+            window = self.canvas.create_window((0, 0), window=block, anchor="nw", width=self.width, height=self.row_height)
+            self.rows.append((window, view))
+
+        first = int(self.canvas.canvasy(0)) // self.row_height
+        for offset, (window, view) in enumerate(self.rows):
+            index = first + offset
+            if index < self.count:
+                self.canvas.coords(window, 0, index * self.row_height)
+                self.canvas.itemconfigure(window, state='normal')
+                self.show_row(view, index)
+            else:
+                self.canvas.itemconfigure(window, state='hidden')
 
 '''
 Tkinter GUI app for Smart Home
 '''
 class SmartHomeGUI(Tk):
     WINDOW_WIDTH_PERCENTAGE = 0.8
+    REFRESH_INTERVAL = 30
+    DEVICE_BLOCK_HEIGHT = 150
+    LOG_ROW_HEIGHT = 30
 
     def __init__(self):
         super().__init__()
-        self.system = AutomationSystem()
+        self.system = AutomationSystem(max_devices=None)
         self.title("Smart Home")
         self.screen_width = self.winfo_screenwidth()
         self.screen_height = self.winfo_screenheight()
@@ -53,38 +202,24 @@ class SmartHomeGUI(Tk):
 
         self.add_new_button = Button(self.first_column_frame, text="Add new device...", command=self.create_add_window)
         self.add_new_button.pack(pady=10)
+        self.import_button = Button(self.first_column_frame, text="Import devices...", command=self.import_devices_command)
+        self.import_button.pack(pady=10)
         self.start_simulation_button = Button(self.first_column_frame, text="Start simulation", command=self.start_simulation)
         self.start_simulation_button.pack(pady=10)
         self.stop_simulation_button = Button(self.first_column_frame, text="Stop simulation", command=self.stop_simulation, state=DISABLED)
         self.stop_simulation_button.pack(pady=10)
 
         self.canvas1 = Canvas(self.first_column_frame, bg="white", width=self.column_width)
-        self.scrollbar1 = Scrollbar(self.first_column_frame, orient="vertical", command=self.canvas1.yview)
-        self.canvas1.config(yscrollcommand=self.scrollbar1.set)
+        self.scrollbar1 = Scrollbar(self.first_column_frame, orient="vertical")
         
         self.canvas1.pack(side=LEFT, fill=BOTH, expand=True)
         self.scrollbar1.pack(side=RIGHT, fill=Y)
 
-        y_coordinate = 0
-        block_height = 150
-        self.device_blocks = {}
-        for i in range(self.system.MAX_DEVICES):
-            block = Frame(self.canvas1, width=self.column_width, height=block_height)
-            block.pack(pady=10, padx=10)
-
-            button = Button(block, style='Red.TButton')
-            button.grid_forget()
-            self.device_blocks[i] = {
-                'block': block,
-                'deviceNameLabel': Label(block),
-                'toggleButton': button,
-                'labelOne': Label(block),
-                'scale': Scale(block),
-
-            }
-            
-            self.canvas1.create_window((0, y_coordinate), window=block, anchor="nw")
-            y_coordinate += block_height
+        # Only the visible device blocks are created, and they are reused while scrolling
+        self.devices = []
+        self.block_of_device = {}
+        self.device_list = VirtualList(self.canvas1, self.scrollbar1, self.column_width, self.DEVICE_BLOCK_HEIGHT,
+                                       lambda block: DeviceBlockView(self, block), self.show_device_block)
         
         # Logs column   
         self.second_column_frame = Frame(self.frame)
@@ -94,19 +229,23 @@ class SmartHomeGUI(Tk):
         self.logs_label.pack(pady=10) 
 
         self.canvas2 = Canvas(self.second_column_frame, bg="white", width=self.column_width) 
+        self.scrollbar2 = Scrollbar(self.second_column_frame, orient="vertical")
         self.canvas2.pack(side=LEFT, fill=BOTH, expand=True)
-
-        y_coordinate = 0
-        block_height = 25
-        self.log_labels = []
-        for i in range(AutomationSystem.MAX_LOGS):
-            block = Frame(self.canvas2, width=self.column_width, height=block_height)
-            label = Label(block, font=('Arial', 13))
-            self.log_labels.append(label)
-            label.pack(expand=True)
-            block.pack(pady=5, padx=5)
-            self.canvas2.create_window((0, y_coordinate), window=block, anchor="nw")
-            y_coordinate += block_height
+        self.scrollbar2.pack(side=RIGHT, fill=Y)
+
+        # Every stored log can be scrolled to, but only the visible rows have labels
+        self.log_list = VirtualList(self.canvas2, self.scrollbar2, self.column_width, self.LOG_ROW_HEIGHT,
+                                    LogRowView, self.show_log_row)
+        self.rendered_log_sequence = None
+
+        # State changes arrive coalesced in batches, which only mark the devices dirty;
+        # they are rendered on the Tk main loop
+        self.dirty_lock = threading.Lock()
+        self.dirty_devices = set()
+        self.structure_changed = False
+        self.notifier = CoalescingNotifier().attach(self.system)
+        self.notifier.subscribe(self.on_state_changes)
+        self.after(self.REFRESH_INTERVAL, self.apply_changes)
 
     '''
         Responsible for creating a new window when adding a new device
@@ -160,18 +299,29 @@ class SmartHomeGUI(Tk):
                     case 'Security Camera':
                         self.system.add_device(SecurityCamera(self.system.device_id_count, name))
                 self.system.increase_id_count()
-                self.update_device_view()
                 self.add_device_window.destroy()     
         except AutomationSystem.DeviceLimitReached as ex:
             messagebox.showinfo("Info", ex)    
 
+    '''
+        Adds every device of a scenario file (JSON or CSV) to the system at once
+        The devices are provisioned in bulk, so the view is only refreshed once
+    '''
+    def import_devices_command(self):
+        path = filedialog.askopenfilename(filetypes=[("Scenario files", "*.json *.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            load_scenario(path).provision(self.system)
+        except (OSError, ValueError, Scenario.InvalidScenario, AutomationSystem.DeviceLimitReached) as ex:
+            messagebox.showinfo("Info", ex)
+
 
     '''
         Command for changing a device state
     '''
     def toggle_button_command(self, device):
         device.turn_off(self.system) if device.get_status() == Status.ON else device.turn_on(self.system)
-        self.update_device_view()
 
     '''
         Command for updating a device's brightness according to user input
@@ -182,7 +332,6 @@ class SmartHomeGUI(Tk):
 
         if (device.get_status()==Status.ON):
             device.set_brightness(self.system, int(scale.get()))
-            self.update_device_view()
     
     '''
         Command for updating a device's temperature according to user input
@@ -193,51 +342,71 @@ class SmartHomeGUI(Tk):
         
         if (device.get_status()==Status.ON):
             device.set_temperature(self.system, int(scale.get()))
+
+    '''
+    Called with every batch of state changes, possibly from the simulation thread: marks the devices dirty
+    '''
+    def on_state_changes(self, batch):
+        with self.dirty_lock:
+            self.dirty_devices.update(batch.device_ids())
+            if batch.structure_changed():
+                self.structure_changed = True
+
+    '''
+    Runs on the Tk main loop: renders the dirty devices and the new logs, then schedules itself again
+    Devices which are not visible are not rendered at all, the visible ones are read from a consistent snapshot
+    '''
+    def apply_changes(self):
+        with self.dirty_lock:
+            dirty_devices, self.dirty_devices = self.dirty_devices, set()
+            structure_changed, self.structure_changed = self.structure_changed, False
+        if structure_changed:
             self.update_device_view()
+        else:
+            snapshot = self.system.snapshot()
+            for device_id in dirty_devices:
+                block = self.block_of_device.get(device_id)
+                if block is not None:
+                    block.render(snapshot.get(device_id))
+            self.update_logs_view()
+        self.after(self.REFRESH_INTERVAL, self.apply_changes)
+
+    '''
+    Shows the device at the given index of the list in a recycled block
+    '''
+    def show_device_block(self, block, index):
+        device = self.devices[index]
+        if block.device is not None and self.block_of_device.get(block.device.get_id()) is block:
+            del self.block_of_device[block.device.get_id()]
+        if block.device is not device:
+            block.bind(device)
+        self.block_of_device[device.get_id()] = block
+        block.render(self.system.snapshot().get(device.get_id()))
+
+    '''
+    Shows the log at the given index, newest first, in a recycled row
+    '''
+    def show_log_row(self, row, index):
+        entry = self.system.log_store.get(self.system.log_store.next_sequence() - 1 - index)
+        row.render(entry.format() if entry else '')
 
     '''
     Updating the widgets in the left-side canvas
     '''
     def update_device_view(self):
-        for idx, device in enumerate(self.system.get_devices()):
-            self.device_blocks[idx]['deviceNameLabel'].config(text=device.get_name())
-            self.device_blocks[idx]['deviceNameLabel'].grid(row=idx, column=0, sticky="w", padx=10, pady=10)
-            
-            self.device_blocks[idx]['toggleButton'].config(text=f"{'Toggle ON' if device.get_status() == Status.OFF else 'Toggle OFF'}")
-            self.device_blocks[idx]['toggleButton'].config(style=f"{'Red.TButton' if device.get_status() == Status.OFF else 'Green.TButton'}")
-            self.device_blocks[idx]['toggleButton'].bind("<Button-1>", lambda event, param=device: self.toggle_button_command(param))
-            self.device_blocks[idx]['toggleButton'].grid(row=idx, column=1, sticky="w", padx=10, pady=10)
-
-            if isinstance(device, SmartLight):
-                self.device_blocks[idx]['labelOne'].config(text=f'Current brightness: {"0" if device.get_status()==Status.OFF else device.get_brightness()}%')
-                self.device_blocks[idx]['labelOne'].grid(row=idx + 1, column=0, columnspan=2, sticky='w', padx=50, pady=5)
-
-                self.device_blocks[idx]['scale'].config(from_=SmartLight.MIN_BRIGHTNESS, to=SmartLight.MAX_BRIGHTNESS, orient="horizontal", length=300)
-                self.device_blocks[idx]['scale'].set(device.get_brightness())
-                self.device_blocks[idx]['scale'].grid(row=idx + 2, column = 0, columnspan = 2, sticky='w', padx=50, pady=5)
-                self.device_blocks[idx]['scale'].bind("<ButtonRelease-1>", lambda event, param1=self.device_blocks[idx]['scale'], param2=device: self.on_brightness_change(param1, param2))
-            elif isinstance(device, Thermostat):
-                self.device_blocks[idx]['labelOne'].config(text=f'Current temperature: {"Unknown" if device.get_status()==Status.OFF else str(device.get_temperature()) + "°C"}')
-                self.device_blocks[idx]['labelOne'].grid(row=idx + 1, column=0, columnspan=2, sticky='w', padx=50, pady=5)
-
-                self.device_blocks[idx]['scale'].config(from_=Thermostat.MIN_TEMP, to=Thermostat.MAX_TEMP, orient="horizontal", length=300)
-                self.device_blocks[idx]['scale'].set(device.get_temperature())
-                self.device_blocks[idx]['scale'].grid(row=idx + 2, column = 0, columnspan = 2, sticky='w', padx=50, pady=5)
-                self.device_blocks[idx]['scale'].bind("<ButtonRelease-1>", lambda event, param1=self.device_blocks[idx]['scale'], param2=device: self.on_temperature_change(param1, param2))
-            elif isinstance(device, SecurityCamera):
-                self.device_blocks[idx]['labelOne'].config(text=f'Current security state: {"Unknown" if device.get_status() == Status.OFF else device.get_security_status().name}')
-                self.device_blocks[idx]['labelOne'].grid(row=idx + 1, column=0, columnspan=2, sticky='w', padx=50, pady=5)
-
+        self.devices = list(self.system.get_devices())
+        self.block_of_device = {}
+        self.device_list.set_count(len(self.devices))
         self.update_logs_view()
-        self.canvas1.update_idletasks()
-        self.canvas1.config(scrollregion=self.canvas1.bbox("all"))
 
     '''
-    Updating the widgets in the right-side canvas
+    Updating the visible rows in the right-side canvas, if there are new logs
     '''
     def update_logs_view(self):
-        for idx, log in enumerate(self.system.logs):
-            self.log_labels[idx].config(text=log)
+        if self.rendered_log_sequence == self.system.log_store.next_sequence():
+            return
+        self.rendered_log_sequence = self.system.log_store.next_sequence()
+        self.log_list.set_count(len(self.system.log_store))
 
     '''
     Stopping the simulation thread
@@ -253,11 +422,6 @@ class SmartHomeGUI(Tk):
     def start_simulation(self):
         if not self.system.can_run_simulation():
             return
-        
-        # Starting a thread to refresh the view in certain interval
-        self.view_thread = threading.Thread(target=lambda: self.refresh_view())
-        self.view_thread.daemon = True
-        
 
         self.start_simulation_button.config(state=DISABLED)
         self.stop_simulation_button.config(state=ACTIVE)
@@ -265,15 +429,6 @@ class SmartHomeGUI(Tk):
         self.simulation_thread.daemon = True
 
         self.simulation_thread.start()
-        self.view_thread.start()
-
-    '''
-    Starting a separate thread for updating the widgets in certain interval while the simulation is running
-    '''
-    def refresh_view(self):
-        while self.system.sim_is_running:
-            self.update_device_view()
-            time.sleep(0.01)
         
 
 '''
@@ -1,22 +1,61 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 
 from datetime import time
 from datetime import *
+import math
 import time
 import threading
 
+from smarthome.clock import *
 from smarthome.devices import *
+from smarthome.events import *
+from smarthome.logstore import *
+from smarthome.metrics import *
+from smarthome.registry import *
+from smarthome.rng import *
+from smarthome.scheduler import *
+from smarthome.state import *
 
 
+'''
+    Plural nouns of the device types, used to summarize the logs about many devices
+'''
+DEVICE_NOUNS = {
+    SmartLight: 'lights',
+    Thermostat: 'thermostats',
+    SecurityCamera: 'cameras',
+}
+
+'''
+    Returns the plural noun of the type of a device
+'''
+def device_noun(device):
+    for device_type in type(device).__mro__:
+        if device_type in DEVICE_NOUNS:
+            return DEVICE_NOUNS[device_type]
+    return f'{type(device).__name__} devices'
+
 '''
     Abstract class representing an automation rule
+    Rules react to the state changes they subscribe to while the simulation is running
 '''
 class AutomationRule:
     def __init__(self, description):
         self.description = description
 
+    '''
+        Subscribes the rule to the events it reacts to
+    '''
+    @abstractmethod
+    def start(self, system):
+        pass
+
+    '''
+        Unsubscribes the rule from the system's events
+    '''
     @abstractmethod
-    def __run(self):
+    def stop(self, system):
         pass
 
 '''
@@ -25,38 +64,66 @@ class AutomationRule:
 class TurnOffCamerasOnAlert(AutomationRule):
     def __init__(self):
         super().__init__('Turn off every light when one of the Security Cameras\' status changes to \"ALERT\"')
+        self.__system = None
+        self.__alerting_cameras = set()
     
     '''
         Turns off every smart light in the system
     '''
     def __turn_off_lights(self, system):
-        for device in system.get_devices():
-            if isinstance(device, SmartLight):
+        with system.log_burst():
+            for device in system.get_devices_of_type(SmartLight):
                 device.turn_off(system)
 
     '''
-        While the simulation is running, it keeps checking if any of the cameras is on ALERT.
-        If so, then it turns off the lights in the system
+        When a camera's status changes to ALERT, it turns off the lights in the system
+    '''
+    def __on_security_status_changed(self, event):
+        if event.value == SecurityStatus.ALERT:
+            self.__alerting_cameras.add(event.device.get_id())
+            self.__turn_off_lights(self.__system)
+        else:
+            self.__alerting_cameras.discard(event.device.get_id())
+
     '''
-    def __run(self, system):
-        while system.sim_is_running:
-            for device in system.get_devices():
-                if isinstance(device, SecurityCamera) and device.get_security_status() == SecurityStatus.ALERT:
-                    self.__turn_off_lights(system)
-                    break
-            time.sleep(0.5)
+        While any of the cameras is on ALERT, the lights turned on are turned off again
+    '''
+    def __on_status_changed(self, event):
+        if self.__alerting_cameras and event.value == Status.ON and isinstance(event.device, SmartLight):
+            event.device.turn_off(self.__system)
     
     '''
-        Starts a thread which runs the automation
+        Subscribes the automation to security and power status changes
     '''
     def start(self, system):
-        thread = threading.Thread(target=lambda: self.__run(system))
-        thread.daemon = True
-        thread.start()
+        self.__system = system
+        self.__alerting_cameras = {device.get_id() for device in system.get_devices_of_type(SecurityCamera)
+                                   if device.get_security_status() == SecurityStatus.ALERT}
+        system.events.subscribe(EventType.SECURITY_STATUS_CHANGED, self.__on_security_status_changed)
+        system.events.subscribe(EventType.STATUS_CHANGED, self.__on_status_changed)
+        if self.__alerting_cameras:
+            self.__turn_off_lights(system)
+
+    '''
+        Unsubscribes the automation
+    '''
+    def stop(self, system):
+        system.events.unsubscribe(EventType.SECURITY_STATUS_CHANGED, self.__on_security_status_changed)
+        system.events.unsubscribe(EventType.STATUS_CHANGED, self.__on_status_changed)
+        self.__system = None
 
 
 '''
     Automation System class for managing smart devices
+
+    Every change of the state is committed holding the lock of the system, by the simulation,
+    the automations and any other thread alike. Readers can take a snapshot of the whole home instead,
+    which is immutable and only rebuilt when the state changed since the last one.
+    With time skipping, the ramps of the devices are analytic (see Ramp) and the devices which are off
+    are not polled every round, they are resumed at the round they would have noticed being turned on at.
+    The metrics of the system can be pulled at any time; the timing of the device steps and of the
+    event handlers is only installed when the metrics are enabled.
+    The logs written in a burst (e.g. by an automation acting on every light) are summarized, see log_burst.
 '''
 class AutomationSystem:
     '''
@@ -68,34 +135,257 @@ class AutomationSystem:
 
     MAX_DEVICES = 20
     MAX_LOGS = 20
+    DEVICE_PAUSE = 2
+    ROUND_PAUSE = 5
     
-    def __init__(self):
-        self.__devices = []
+    def __init__(self, clock=None, max_devices=MAX_DEVICES, log_capacity=LogStore.DEFAULT_CAPACITY, seed=None,
+                 rng_batch_size=None, automations=None, metrics=False, time_skipping=False):
+        self.lock = threading.RLock()
+        self.__devices = DeviceRegistry(max_devices)
+        self.random_streams = RandomStreams(seed, rng_batch_size)
+        self.__random = {}
         self.device_id_count = 1
-        self.logs = []
-        self.automations = [TurnOffCamerasOnAlert()]
+        self.log_store = LogStore(log_capacity)
+        self.automations = list(automations) if automations is not None else [TurnOffCamerasOnAlert()]
+        self.clock = clock if clock else Clock()
+        self.scheduler = Scheduler(self.clock, self.lock)
+        self.events = EventBus(self.clock)
+        self.events.subscribe(EventType.STATUS_CHANGED, self.__devices.on_status_changed)
+        self.__version = 0
+        self.__changed_devices = set()
+        self.__device_states = {}
+        self.__snapshot = HomeSnapshot(0, self.clock.now(), {})
+        self.time_skipping = time_skipping
+        self.__ramping = set()
+        self.__waiting_for_on = {}
+        if time_skipping:
+            self.events.subscribe(EventType.STATUS_CHANGED, self.__on_status_changed)
+        self.__log_burst = None
+        self.__start_hooks = []
+        self.__stop_hooks = []
         self.__sim_should_run = False
+        self.__simulate_devices = True
         self.sim_is_running = False      
+        self.metrics = MetricsRegistry(metrics)
+        self.__register_metrics()
     '''
-        Returns the current time in YYYY.MM.DD HH:MM:SS format
+        Registers the metrics of the system
+        Counts the system keeps anyway are only read when the metrics are sampled
     '''
-    def __get_current_time(self):
-        current_time = datetime.now()
-        return current_time.strftime("%Y.%m.%d %H:%M:%S")
-    
+    def __register_metrics(self):
+        metrics = self.metrics
+        metrics.gauge('smarthome_devices', 'Number of devices by power status', ['status'],
+                      lambda: {(status.name,): self.__devices.count(status) for status in Status})
+        metrics.counter('smarthome_state_changes_total', 'State changes of the devices', function=lambda: self.__version)
+        metrics.counter('smarthome_logs_total', 'Log entries written', function=self.log_store.next_sequence)
+        metrics.counter('smarthome_scheduler_events_total', 'Events run by the scheduler',
+                        function=lambda: self.scheduler.event_count)
+        metrics.gauge('smarthome_scheduler_pending_events', 'Events waiting on the scheduler', function=self.scheduler.pending)
+        metrics.gauge('smarthome_simulation_running', 'Whether the simulation is running',
+                      function=lambda: int(self.sim_is_running))
+        metrics.gauge('smarthome_simulated_time_seconds', 'Time of the simulation clock', function=self.clock.now)
+        self.__step_seconds = None
+        self.__dispatch_seconds = None
+        self.__slowest_step = (None, 0)
+        if metrics.enabled:
+            self.__step_seconds = metrics.histogram('smarthome_device_step_seconds',
+                                                    'Wall-clock time of a simulation step of a device', ['device_type'])
+            dispatch_seconds = metrics.histogram('smarthome_event_dispatch_seconds',
+                                                 'Wall-clock time the subscribers (e.g. the rules) take to react to a state change',
+                                                 ['event'])
+            self.__dispatch_seconds = {event_type: dispatch_seconds.labels(event_type.name) for event_type in EventType}
+            metrics.gauge('smarthome_slowest_step_seconds', 'Slowest simulation step of a device so far', ['device'],
+                          lambda: {(str(self.__slowest_step[0]),): self.__slowest_step[1]})
+
+    '''
+        Records the time a simulation step of a device took
+    '''
+    def __observe_step(self, device, seconds):
+        self.__step_seconds.labels(type(device).__name__).observe(seconds)
+        if seconds > self.__slowest_step[1]:
+            self.__slowest_step = (device.get_id(), seconds)
+
+    '''
+        Adds a new message to the log store, with the device, event type and value it is about
+        Returns the sequence number of the entry
+    '''
+    def add_log(self, msg, device=None, event_type=None, value=None):
+        device_id = device.get_id() if device else None
+        with self.lock:
+            if self.__log_burst is not None:
+                self.__add_to_burst(msg, device, event_type, value)
+                return None
+            return self.log_store.append(self.clock.now(), msg, device_id, event_type, value)
+
+    '''
+        Context manager summarizing the logs written inside it, holding the lock of the system
+        The logs about the same change of several devices of the same type become a single entry,
+        e.g. "25 lights turned OFF", written when the burst ends; the other logs are written as they are.
+        Bursts can be nested, the logs are written when the outermost one ends
+    '''
+    @contextmanager
+    def log_burst(self):
+        with self.lock:
+            if self.__log_burst is not None:
+                yield
+                return
+            self.__log_burst = {}
+            try:
+                yield
+            finally:
+                burst, self.__log_burst = self.__log_burst, None
+                for (noun, change, event_type, value), logs in burst.items():
+                    if len(logs) == 1:
+                        self.add_log(*logs[0])
+                    else:
+                        self.log_store.append(self.clock.now(), f'{len(logs)} {noun}{change}', None, event_type, value)
+
+    '''
+        Groups a log of a burst with the logs about the same change, the message without the name of the device
+    '''
+    def __add_to_burst(self, msg, device, event_type, value):
+        name = device.get_name() if device else None
+        if name is None or event_type is None or not msg.startswith(name):
+            key = (None, object(), None, None)
+        else:
+            key = (device_noun(device), msg[len(name):], event_type, value)
+        self.__log_burst.setdefault(key, []).append((msg, device, event_type, value))
+
+    '''
+        Returns the newest log messages in YYYY.MM.DD HH:MM:SS - message format, newest first
+    '''
+    def get_logs(self, count=MAX_LOGS):
+        return [entry.format() for entry in self.log_store.latest(count)]
+
+    '''
+        Returns the random stream of a device, derived from the seed of the system and the id of the device
+    '''
+    def get_random(self, device):
+        stream = self.__random.get(device.get_id())
+        if stream is None:
+            stream = self.random_streams.stream(device.get_id())
+            self.__random[device.get_id()] = stream
+        return stream
+
+    '''
+        Notifies the subscribers about a state change of a device
+    '''
+    def publish(self, event_type, device, value):
+        with self.lock:
+            self.__version += 1
+            self.__changed_devices.add(device.get_id())
+            if self.__dispatch_seconds is None:
+                self.events.publish(event_type, device, value)
+            else:
+                start = time.perf_counter()
+                self.events.publish(event_type, device, value)
+                self.__dispatch_seconds[event_type].observe(time.perf_counter() - start)
+
+    '''
+        Records that the state of the given devices changed, without notifying the subscribers
+    '''
+    def mark_changed(self, devices):
+        with self.lock:
+            self.__version += 1
+            self.__changed_devices.update(device.get_id() for device in devices)
+
+    '''
+        Records that an analytic ramp of a device started or ended
+        The value of a ramping device changes with the clock, so it is read again by every new snapshot
     '''
-        Adds a new message to the stored message list
+    def set_ramping(self, device, ramping):
+        with self.lock:
+            if ramping:
+                self.__ramping.add(device)
+            else:
+                self.__ramping.discard(device)
+
+    '''
+        Resumes the process of a device waiting to be turned on
+    '''
+    def __on_status_changed(self, event):
+        if event.value == Status.ON:
+            signal = self.__waiting_for_on.pop(event.device.get_id(), None)
+            if signal:
+                signal.fire()
+
+    '''
+        Returns an immutable snapshot of every device
+        If nothing changed since the last snapshot it is returned without locking,
+        otherwise only the states of the changed (or ramping) devices are read again
+    '''
+    def snapshot(self):
+        snapshot = self.__snapshot
+        if snapshot.version == self.__version and not (self.__ramping and snapshot.time != self.clock.now()):
+            return snapshot
+        with self.lock:
+            if self.__ramping and self.__snapshot.time != self.clock.now():
+                self.mark_changed(self.__ramping)
+            if self.__snapshot.version != self.__version:
+                for device_id in self.__changed_devices:
+                    device = self.__devices.get(device_id)
+                    if device is None:
+                        self.__device_states.pop(device_id, None)
+                    else:
+                        self.__device_states[device_id] = device_state(device)
+                self.__changed_devices.clear()
+                self.__snapshot = HomeSnapshot(self.__version, self.clock.now(), dict(self.__device_states))
+            return self.__snapshot
+
+    '''
+        Adds an automation, which is started right away if the simulation is running
+    '''
+    def add_automation(self, automation):
+        with self.lock:
+            self.automations.append(automation)
+            if self.sim_is_running:
+                automation.start(self)
+
+    '''
+        Registers callbacks called with the system, holding its lock, when a simulation starts (once the scheduler
+        is cleared, before the automations start) and when it stops (once the automations stopped)
+        For components with state on the scheduler, e.g. timers, which does not survive a simulation
+    '''
+    def add_simulation_hooks(self, on_start=None, on_stop=None):
+        with self.lock:
+            if on_start:
+                self.__start_hooks.append(on_start)
+            if on_stop:
+                self.__stop_hooks.append(on_stop)
+
     '''
-    def add_log(self, msg):
-        if len(self.logs) == self.MAX_LOGS:
-            self.logs.pop()
-        self.logs.insert(0, f'{self.__get_current_time()} - {msg}')
+        Removes previously registered simulation callbacks
+    '''
+    def remove_simulation_hooks(self, on_start=None, on_stop=None):
+        with self.lock:
+            if on_start in self.__start_hooks:
+                self.__start_hooks.remove(on_start)
+            if on_stop in self.__stop_hooks:
+                self.__stop_hooks.remove(on_stop)
 
     '''
         Returns the devices of the system
     '''
     def get_devices(self):
         return self.__devices
+
+    '''
+        Returns the device with the given id, None if there is no such device
+    '''
+    def get_device(self, device_id):
+        return self.__devices.get(device_id)
+
+    '''
+        Returns the devices of the given type
+    '''
+    def get_devices_of_type(self, device_type):
+        return self.__devices.of_type(device_type)
+
+    '''
+        Returns the number of devices with the given power status, or every device if no status was given
+    '''
+    def count_devices(self, status=None):
+        return self.__devices.count(status)
     
     '''
         Sets a new, unique id for the next device
@@ -103,53 +393,153 @@ class AutomationSystem:
     def increase_id_count(self):
         self.device_id_count += 1
     
+    '''
+        Reserves a block of consecutive ids for new devices, returned as a range
+    '''
+    def allocate_ids(self, count):
+        with self.lock:
+            ids = range(self.device_id_count, self.device_id_count + count)
+            self.device_id_count += count
+            return ids
+
+    '''
+        Adds many devices to the system in a single step
+        The capacity is checked once for all of them and a single summary log is written (unless log is false).
+        DEVICE_ADDED is only published if anybody subscribed to it
+    '''
+    def add_devices(self, devices, log=True):
+        devices = list(devices)
+        with self.lock:
+            capacity = self.__devices.get_capacity()
+            if capacity is not None and len(self.__devices) + len(devices) > capacity:
+                raise self.DeviceLimitReached(f'Can not add {len(devices)} devices: maximum reached')
+            for device in devices:
+                if self.__devices.get(device.get_id()) is not None:
+                    raise DeviceRegistry.DuplicateDevice(f'A device with id {device.get_id()} is already registered')
+            for device in devices:
+                self.__devices.add(device)
+            if log:
+                self.add_log(f'{len(devices)} devices added', None, EventType.DEVICE_ADDED, len(devices))
+            self.mark_changed(devices)
+            self.events.publish_many(EventType.DEVICE_ADDED, devices, None)
+            if self.sim_is_running and self.__simulate_devices:
+                for device in devices:
+                    self.scheduler.spawn(self.__simulate_device(device))
+        return devices
+
+    '''
+        Creates the given number of devices of a type, with a block of ids and the given power status
+        The devices still have to be added to the system
+    '''
+    def create_devices(self, device_type, count, status=Status.OFF):
+        devices = [device_type(device_id) for device_id in self.allocate_ids(count)]
+        if status != Status.OFF:
+            for device in devices:
+                device.set_status(status)
+        return devices
+
+    '''
+        Creates and adds the given number of devices of a type
+        Returns the new devices
+    '''
+    def provision(self, device_type, count, status=Status.OFF):
+        return self.add_devices(self.create_devices(device_type, count, status))
+
     '''
         Adds a new device to the system
     '''
     def add_device(self, device):
-        if len(self.__devices) < self.MAX_DEVICES:
-            self.__devices.append(device)
-            self.add_log(f'Device added: {device.get_name()}')
-        else:
-            raise self.DeviceLimitReached('Can not add more devices: maximum reached')      
+        with self.lock:
+            if not self.__devices.is_full():
+                self.__devices.add(device)
+                self.add_log(f'Device added: {device.get_name()}', device, EventType.DEVICE_ADDED)
+                self.publish(EventType.DEVICE_ADDED, device, None)
+                if self.sim_is_running and self.__simulate_devices:
+                    self.scheduler.spawn(self.__simulate_device(device))
+            else:
+                raise self.DeviceLimitReached('Can not add more devices: maximum reached')      
 
     '''
         Removes a device from the system
     '''
     def remove_device(self, device):
-        self.__devices.remove(device)
-        self.add_log(f'Device removed: {device.get_name()}')
+        with self.lock:
+            self.__devices.remove(device)
+            self.__random.pop(device.get_id(), None)
+            signal = self.__waiting_for_on.pop(device.get_id(), None)
+            if signal:
+                signal.fire()
+            self.add_log(f'Device removed: {device.get_name()}', device, EventType.DEVICE_REMOVED)
+            self.publish(EventType.DEVICE_REMOVED, device, None)
 
     '''
         Checks if it is possible to run the simulation at the current state
     '''
     def can_run_simulation(self):
-        for device in self.__devices:
-            if device.get_status() == Status.ON:
-                return True
-        return False
+        return self.__devices.any_on()
 
     '''
         Starts the simulation
+        It runs until it is stopped, or for the given duration (in simulated seconds) if one was given.
+        Without simulate_devices, the devices are not simulated: they are driven from outside (e.g. by an ingest server),
+        while the automations and the timers run as usual
     '''
-    def start_simulation(self):
-        if not self.can_run_simulation():
+    def start_simulation(self, duration=None, simulate_devices=True):
+        if simulate_devices and not self.can_run_simulation():
             return
 
-        self.add_log('Simulation running...')
-        self.__sim_should_run = True
-        self.sim_is_running = True
+        until = self.__begin_simulation(duration, simulate_devices)
+        try:
+            self.scheduler.run(until)
+        finally:
+            self.__end_simulation()
 
-        self.__start_automations()
+    '''
+        Coroutine version of start_simulation, for asyncio applications
+        Every device is simulated by a lightweight process on the scheduler; the simulation stops
+        at once when stop_simulation is called or when the task running it is cancelled
+    '''
+    async def run_simulation_async(self, duration=None, simulate_devices=True):
+        if simulate_devices and not self.can_run_simulation():
+            return
+        until = self.__begin_simulation(duration, simulate_devices)
+        try:
+            await self.scheduler.run_async(until)
+        finally:
+            self.__end_simulation()
 
-        while self.__sim_should_run:
-            for device in self.__devices:
-                if device.run_simulation(self):
-                    time.sleep(2)
-            time.sleep(5)
+    '''
+        Starts the automations and the processes of the devices
+        Returns the time the simulation should end at, None if it runs until it is stopped
+    '''
+    def __begin_simulation(self, duration, simulate_devices=True):
+        with self.lock:
+            self.add_log('Simulation running...')
+            self.__sim_should_run = True
+            self.__simulate_devices = simulate_devices
+            self.sim_is_running = True
+
+            self.scheduler.clear()
+            for hook in tuple(self.__start_hooks):
+                hook(self)
+            self.__start_automations()
 
-        self.add_log('Simulation stopped')
-        self.sim_is_running = False
+            if simulate_devices:
+                for device in self.__devices:
+                    self.scheduler.spawn(self.__simulate_device(device))
+            return None if duration is None else self.clock.now() + duration
+
+    def __end_simulation(self):
+        with self.lock:
+            self.__sim_should_run = False
+            for device in list(self.__ramping):
+                device.interrupt(self)
+            self.__waiting_for_on.clear()
+            self.__stop_automations()
+            for hook in tuple(self.__stop_hooks):
+                hook(self)
+            self.add_log('Simulation stopped')
+            self.sim_is_running = False
 
     '''
         Stops the simulation
@@ -157,8 +547,41 @@ class AutomationSystem:
     def stop_simulation(self):
         self.add_log('Stopping simulation...')
         self.__sim_should_run = False
+        self.scheduler.stop()
+
+    '''
+        Process simulating a single device, until the simulation stops or the device is removed
+        Every device progresses on its own, independently of the others
+    '''
+    def __simulate_device(self, device):
+        while self.__sim_should_run and device in self.__devices:
+            run = device.run_simulation(self)
+            if self.__step_seconds is not None:
+                run = timed(run, lambda seconds: self.__observe_step(device, seconds))
+            if (yield from run):
+                yield self.DEVICE_PAUSE
+            elif self.time_skipping and device.get_status() == Status.OFF:
+                yield from self.__wait_for_on(device)
+                continue
+            yield self.ROUND_PAUSE
+
+    '''
+        Waits until a device which is off is turned on, then until the end of the round the device
+        would have noticed it at, if it was polled every round
+    '''
+    def __wait_for_on(self, device):
+        idle_since = self.clock.now()
+        signal = Signal()
+        self.__waiting_for_on[device.get_id()] = signal
+        yield signal
+        rounds = max(1, math.ceil((self.clock.now() - idle_since) / self.ROUND_PAUSE - Ramp.EPSILON))
+        yield idle_since + rounds * self.ROUND_PAUSE - self.clock.now()
 
     def __start_automations(self):
         for automation in self.automations:
             automation.start(self)
+
+    def __stop_automations(self):
+        for automation in self.automations:
+            automation.stop(self)
     
\ No newline at end of file
@@ -0,0 +1,301 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from smarthome.run import *
+
+'''
+    Benchmark harness for the simulation engine, the rules and the logs
+
+    Every case runs a generated home on a maximum speed clock, so no sleep is ever waited for,
+    with a fixed seed and start time, so the same case always simulates the same events.
+    The cases sweep the number of devices and of declarative rules, and report the events per second,
+    the time the automations take to react to a state change, the log entries written and the peak memory
+    (measured in a separate run, because tracing the allocations slows the simulation down).
+    The alert cases measure the reaction to a camera alert turning off every light of a home, all of them on.
+    The log throughput and the memory of a device are measured on their own. The bytes per device are checked
+    against a budget, --check-memory fails the run if a device type is over it.
+    The results are stored as JSON, and can be compared to a baseline.
+
+    Usage: python -m smarthome.benchmark [--devices 10,1000,100000] [--rules 0,100] [--duration SECONDS]
+                                         [--seed SEED] [--no-memory] [--check-memory]
+                                         [--baseline FILE] [--output FILE]
+'''
+
+DEFAULT_DEVICE_COUNTS = [10, 100, 1000, 10000, 100000]
+DEFAULT_RULE_COUNTS = [0, 10, 100]
+DEFAULT_DURATION = 10
+DEFAULT_SEED = 1
+LOG_ENTRIES = 200000
+MEMORY_DEVICES = 100000
+ALERT_DURATION = 1
+
+'''
+    Budget of the memory (in bytes) of a device which is not added to a system yet, by device type
+    A slotted device takes about 100 bytes, a device with a __dict__ about twice as much
+'''
+DEVICE_BYTES_BUDGET = {
+    'SmartLight': 128,
+    'Thermostat': 136,
+    'SecurityCamera': 120,
+}
+
+'''
+    Share of each device type in the generated homes
+'''
+DEVICE_MIX = {
+    'SmartLight': 0.6,
+    'Thermostat': 0.3,
+    'SecurityCamera': 0.1,
+}
+
+'''
+    Returns the device counts of a home with the given number of devices
+'''
+def device_mix(count):
+    devices = {name: int(count * share) for name, share in DEVICE_MIX.items()}
+    devices['SmartLight'] += count - sum(devices.values())
+    return devices
+
+'''
+    Returns the given number of declarative rules, referencing the brightness of the lights
+    and the temperature of the thermostats, so they are evaluated on the hot path of the ramps
+'''
+def generate_rules(count):
+    rules = []
+    for number in range(count):
+        if number % 2 == 0:
+            when = {'type': 'SmartLight', 'attribute': 'brightness', 'op': '==', 'value': number % 100 + 1}
+        else:
+            when = {'type': 'Thermostat', 'attribute': 'temperature', 'op': '==', 'value': number % 41 - 10}
+        rules.append({'name': f'Benchmark rule #{number}', 'when': when,
+                      'then': {'action': 'log', 'message': f'{{device}} matched rule #{number}'}})
+    return {'rules': rules}
+
+'''
+    Returns the scenario of a benchmark case
+'''
+def benchmark_scenario(device_count, rule_count, duration, seed):
+    return Scenario(f'{device_count} devices, {rule_count} rules', device_mix(device_count), seed, duration,
+                    Clock.MAX_SPEED, start_time=0, rules=generate_rules(rule_count) if rule_count else None)
+
+'''
+    Automation which only calls a handler on every state change, used to surround the other automations
+'''
+class ProbeEdge(AutomationRule):
+    EVENT_TYPES = (EventType.STATUS_CHANGED, EventType.BRIGHTNESS_CHANGED, EventType.TEMPERATURE_CHANGED,
+                   EventType.DESIRED_TEMP_CHANGED, EventType.SECURITY_STATUS_CHANGED)
+
+    def __init__(self, handler):
+        super().__init__('Benchmark probe')
+        self.__handler = handler
+
+    def start(self, system):
+        for event_type in self.EVENT_TYPES:
+            system.events.subscribe(event_type, self.__handler)
+
+    def stop(self, system):
+        for event_type in self.EVENT_TYPES:
+            system.events.unsubscribe(event_type, self.__handler)
+
+'''
+    Measures how long (in wall-clock time) every automation of the system together takes to react to a state change
+    The handlers of an event are called in the order they subscribed, so the probe subscribes before and after the rules
+    A rule may publish state changes while it reacts (e.g. the lights turned off on a camera alert): only the outermost
+    reaction is recorded, including the reactions to the changes it caused
+    Only the reactions to the given event type are recorded, if any
+'''
+class RuleReactionProbe:
+    def __init__(self, system, event_type=None):
+        self.latencies = []
+        self.event_type = event_type
+        self.__starts = []
+        system.automations.insert(0, ProbeEdge(self.__begin))
+        system.automations.append(ProbeEdge(self.__end))
+
+    def __begin(self, event):
+        self.__starts.append(time.perf_counter())
+
+    def __end(self, event):
+        if not self.__starts:
+            return
+        start = self.__starts.pop()
+        if not self.__starts and (self.event_type is None or event.event_type == self.event_type):
+            self.latencies.append(time.perf_counter() - start)
+
+'''
+    Returns the peak memory (in bytes) allocated while building and running a scenario
+'''
+def peak_memory(scenario):
+    tracemalloc.start()
+    try:
+        system = scenario.build()
+        system.start_simulation(scenario.duration)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+'''
+    Runs a benchmark case and returns its metrics
+'''
+def run_case(device_count, rule_count, duration, seed, memory=True):
+    scenario = benchmark_scenario(device_count, rule_count, duration, seed)
+    build_start = time.perf_counter()
+    system = scenario.build()
+    build_seconds = time.perf_counter() - build_start
+    probe = RuleReactionProbe(system)
+    wall_start = time.perf_counter()
+    system.start_simulation(duration)
+    wall_seconds = time.perf_counter() - wall_start
+    events = system.scheduler.event_count
+    latencies_us = [latency * 1e6 for latency in probe.latencies]
+    return {
+        'devices': device_count,
+        'rules': rule_count,
+        'build_seconds': build_seconds,
+        'wall_seconds': wall_seconds,
+        'events': events,
+        'events_per_second': events / wall_seconds if wall_seconds > 0 else None,
+        'log_entries': system.log_store.next_sequence(),
+        'rule_reaction_us': {
+            'count': len(latencies_us),
+            'p50': percentile(latencies_us, 50),
+            'p90': percentile(latencies_us, 90),
+            'p99': percentile(latencies_us, 99),
+            'max': max(latencies_us) if latencies_us else None,
+        },
+        'peak_memory_bytes': peak_memory(scenario) if memory else None,
+    }
+
+'''
+    Runs a home of lights and a camera, all turned on, so the alert of the camera turns off every light,
+    and returns how long the automations take to react to the alerts, the lights turned off included
+'''
+def run_alert_case(light_count, seed):
+    scenario = Scenario(f'{light_count} lights, alert', {'SmartLight': light_count, 'SecurityCamera': 1}, seed,
+                        ALERT_DURATION, Clock.MAX_SPEED, start_time=0)
+    system = scenario.build()
+    probe = RuleReactionProbe(system, EventType.SECURITY_STATUS_CHANGED)
+    system.start_simulation(ALERT_DURATION)
+    latencies_us = [latency * 1e6 for latency in probe.latencies]
+    return {
+        'lights': light_count,
+        'alerts': len(latencies_us),
+        'alert_reaction_us': {
+            'p50': percentile(latencies_us, 50),
+            'max': max(latencies_us) if latencies_us else None,
+        },
+        'lights_on': system.count_devices(Status.ON) - 1,
+    }
+
+'''
+    Returns the number of log entries the system can write per second
+'''
+def log_throughput(count=LOG_ENTRIES):
+    system = AutomationSystem(Clock(Clock.MAX_SPEED, 0), max_devices=None)
+    device = SmartLight(1)
+    start = time.perf_counter()
+    for value in range(count):
+        system.add_log('Benchmark log entry', device, EventType.BRIGHTNESS_CHANGED, value)
+    seconds = time.perf_counter() - start
+    return {'entries': count, 'seconds': seconds, 'entries_per_second': count / seconds if seconds > 0 else None}
+
+'''
+    Returns the memory (in bytes) of a device of every type, the average over the given number of devices,
+    and whether it is within the budget
+'''
+def device_memory(count=MEMORY_DEVICES):
+    results = {}
+    for device_type in (SmartLight, Thermostat, SecurityCamera):
+        devices = [None] * count
+        tracemalloc.start()
+        try:
+            for id in range(count):
+                devices[id] = device_type(id)
+            bytes_per_device = tracemalloc.get_traced_memory()[0] / count
+        finally:
+            tracemalloc.stop()
+        del devices
+        budget = DEVICE_BYTES_BUDGET[device_type.__name__]
+        results[device_type.__name__] = {'bytes': bytes_per_device, 'budget': budget,
+                                         'within_budget': bytes_per_device <= budget}
+    return results
+
+'''
+    Runs every combination of the device and rule counts
+'''
+def run_benchmarks(device_counts, rule_counts, duration=DEFAULT_DURATION, seed=DEFAULT_SEED, memory=True):
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'duration': duration,
+        'seed': seed,
+        'log_throughput': log_throughput(),
+        'device_memory': device_memory() if memory else None,
+        'cases': [run_case(device_count, rule_count, duration, seed, memory)
+                  for device_count in device_counts for rule_count in rule_counts],
+        'alert_cases': [run_alert_case(device_count, seed) for device_count in device_counts],
+    }
+
+'''
+    Returns the events per second of every case relative to the same case of a baseline, by case name
+    Cases which are not in the baseline are left out
+'''
+def compare(results, baseline):
+    baseline_cases = {(case['devices'], case['rules']): case for case in baseline['cases']}
+    ratios = {}
+    for case in results['cases']:
+        base = baseline_cases.get((case['devices'], case['rules']))
+        if base and base['events_per_second'] and case['events_per_second']:
+            ratios[f'{case["devices"]} devices, {case["rules"]} rules'] = case['events_per_second'] / base['events_per_second']
+    return ratios
+
+'''
+    Parses a comma separated list of counts
+'''
+def parse_counts(value):
+    return [int(count) for count in value.split(',') if count]
+
+'''
+    Command line entry point
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smarthome.benchmark', description='Benchmarks the simulation engine.')
+    parser.add_argument('--devices', type=parse_counts, default=DEFAULT_DEVICE_COUNTS, help='comma separated device counts')
+    parser.add_argument('--rules', type=parse_counts, default=DEFAULT_RULE_COUNTS, help='comma separated rule counts')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='simulated seconds of every case')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='random seed of every case')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('--check-memory', action='store_true',
+                        help='exit with an error if a device type is over its bytes per device budget')
+    parser.add_argument('--baseline', help='results of a previous version to compare the events per second to')
+    parser.add_argument('--output', help='file to write the results to, instead of the standard output')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.devices, args.rules, args.duration, args.seed,
+                             not args.no_memory or args.check_memory)
+    if args.baseline:
+        with open(args.baseline) as file:
+            results['baseline_ratio'] = compare(results, json.load(file))
+        for name, ratio in results['baseline_ratio'].items():
+            print(f'{name}: {ratio:.2f}x the baseline events per second', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.check_memory:
+        over = {name: memory for name, memory in results['device_memory'].items() if not memory['within_budget']}
+        for name, memory in over.items():
+            print(f'{name}: {memory["bytes"]:.0f} bytes per device, over the budget of {memory["budget"]}', file=sys.stderr)
+        if over:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
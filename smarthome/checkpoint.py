@@ -0,0 +1,248 @@
+import io
+import pickle
+import zlib
+
+from smarthome.automation_system import *
+
+'''
+    Checkpointing of a whole system: its devices and their state, the id counter, the seed and the logs
+
+    A checkpoint is a zlib-compressed pickle of plain tuples, written holding the lock of the system,
+    so it is consistent. It is read back by an unpickler which only rebuilds the enumerations of the state,
+    so a checkpoint from elsewhere can not run any code when it is loaded. A delta only holds what changed since the previous checkpoint of the same checkpointer:
+    the devices whose state changed, the removed devices and the new logs.
+    The pending steps of the simulation (e.g. a ramp in progress) are not part of a checkpoint,
+    a restored simulation starts the processes of the devices again.
+'''
+
+FORMAT_VERSION = 1
+FULL = 'full'
+DELTA = 'delta'
+
+'''
+    Device classes to rebuild the devices with, by the type name of their state
+'''
+DEVICE_CLASSES = {
+    'SmartLight': SmartLight,
+    'FleetSmartLight': SmartLight,
+    'Thermostat': Thermostat,
+    'FleetThermostat': Thermostat,
+    'SecurityCamera': SecurityCamera,
+    'FleetSecurityCamera': SecurityCamera,
+}
+
+'''
+    Exception which can be raised when a checkpoint can not be read or a delta does not follow its base
+'''
+class InvalidCheckpoint(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+
+'''
+    Unpickler which refuses every global but the enumerations a checkpoint holds
+'''
+class CheckpointUnpickler(pickle.Unpickler):
+    ALLOWED_GLOBALS = {
+        ('smarthome.devices', 'Status'),
+        ('smarthome.devices', 'SecurityStatus'),
+        ('smarthome.events', 'EventType'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED_GLOBALS:
+            raise InvalidCheckpoint(f'Invalid checkpoint: it refers to {module}.{name}')
+        return super().find_class(module, name)
+
+'''
+    Decoded state of a system, which deltas can be applied to
+    Restoring does not modify the checkpoint, so many experiments can be forked from the same one
+'''
+class Checkpoint:
+    def __init__(self, version, time, device_id_count, seed, rng_batch_size, max_devices, log_capacity,
+                 devices, logs):
+        self.version = version
+        self.time = time
+        self.device_id_count = device_id_count
+        self.seed = seed
+        self.rng_batch_size = rng_batch_size
+        self.max_devices = max_devices
+        self.log_capacity = log_capacity
+        self.devices = devices
+        self.logs = logs
+
+    def __len__(self):
+        return len(self.devices)
+
+    '''
+        Applies a delta, which has to follow the state of this checkpoint
+    '''
+    def apply(self, delta):
+        if delta['base_version'] != self.version:
+            raise InvalidCheckpoint(f'Delta of version {delta["base_version"]} does not follow version {self.version}')
+        for device_id in delta['removed']:
+            self.devices.pop(device_id, None)
+        for state in delta['devices']:
+            self.devices[state[0]] = DeviceState(*state)
+        self.logs.extend(delta['logs'])
+        del self.logs[:max(0, len(self.logs) - self.log_capacity)]
+        self.version = delta['version']
+        self.time = delta['time']
+        self.device_id_count = delta['device_id_count']
+
+    '''
+        Creates a new system in the state of the checkpoint (see restore)
+    '''
+    def fork(self, clock=None, seed=None, automations=None):
+        return restore(self, clock, seed, automations)
+
+'''
+    Writes the checkpoints of a system: a full one first, then deltas since the previous one
+    The devices which changed are found by identity: the snapshots of the system share the state
+    of every device which did not change, so no field is compared
+'''
+class Checkpointer:
+    def __init__(self, system):
+        self.system = system
+        self.__base = None
+        self.__log_sequence = 0
+
+    '''
+        Returns a full checkpoint of the system
+    '''
+    def full(self):
+        with self.system.lock:
+            snapshot = self.system.snapshot()
+            data = self.__header(FULL, snapshot)
+            data['devices'] = [tuple(state) for state in snapshot]
+            data['logs'] = self.__logs_since(0)
+            self.__base = snapshot
+            return encode(data)
+
+    '''
+        Returns a delta since the previous checkpoint, or a full checkpoint if there was none
+    '''
+    def delta(self):
+        if self.__base is None:
+            return self.full()
+        with self.system.lock:
+            snapshot = self.system.snapshot()
+            base = self.__base.devices
+            data = self.__header(DELTA, snapshot)
+            data['base_version'] = self.__base.version
+            data['devices'] = [tuple(state) for state in snapshot if base.get(state.id) is not state]
+            data['removed'] = [device_id for device_id in base if device_id not in snapshot.devices]
+            data['logs'] = self.__logs_since(self.__log_sequence)
+            self.__base = snapshot
+            return encode(data)
+
+    '''
+        Writes a checkpoint to a file, a delta if incremental is true
+    '''
+    def save(self, path, incremental=False):
+        data = self.delta() if incremental else self.full()
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def __header(self, kind, snapshot):
+        system = self.system
+        return {
+            'format': FORMAT_VERSION,
+            'kind': kind,
+            'version': snapshot.version,
+            'time': system.clock.now(),
+            'device_id_count': system.device_id_count,
+            'seed': system.random_streams.seed,
+            'rng_batch_size': system.random_streams.batch_size,
+            'max_devices': system.get_devices().get_capacity(),
+            'log_capacity': system.log_store.get_capacity(),
+        }
+
+    '''
+        Returns the logs from the given sequence number on as tuples, and moves the log cursor
+    '''
+    def __logs_since(self, sequence):
+        logs = [(entry.sequence, entry.time, entry.message, entry.device_id, entry.event_type, entry.value)
+                for entry in self.system.log_store.since(sequence)]
+        self.__log_sequence = self.system.log_store.next_sequence()
+        return logs
+
+'''
+    Encodes a checkpoint or a delta
+'''
+def encode(data):
+    return zlib.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), 1)
+
+'''
+    Decodes a checkpoint or a delta
+'''
+def decode(data):
+    try:
+        decoded = CheckpointUnpickler(io.BytesIO(zlib.decompress(data))).load()
+    except (zlib.error, pickle.UnpicklingError, EOFError, ValueError, TypeError, IndexError) as ex:
+        raise InvalidCheckpoint(f'Invalid checkpoint: {ex}')
+    if not isinstance(decoded, dict) or decoded.get('format') != FORMAT_VERSION:
+        raise InvalidCheckpoint('Unsupported checkpoint format')
+    return decoded
+
+'''
+    Decodes a full checkpoint, then applies the given deltas in order
+'''
+def load(data, *deltas):
+    full = decode(data)
+    try:
+        if full['kind'] != FULL:
+            raise InvalidCheckpoint('The first checkpoint has to be a full one')
+        checkpoint = Checkpoint(full['version'], full['time'], full['device_id_count'], full['seed'],
+                                full['rng_batch_size'], full['max_devices'], full['log_capacity'],
+                                {state[0]: DeviceState(*state) for state in full['devices']}, list(full['logs']))
+        for delta in deltas:
+            delta = decode(delta)
+            if delta['kind'] != DELTA:
+                raise InvalidCheckpoint('Only deltas can follow a full checkpoint')
+            checkpoint.apply(delta)
+    except KeyError as ex:
+        raise InvalidCheckpoint(f'Invalid checkpoint: {ex} is missing')
+    except (TypeError, IndexError) as ex:
+        raise InvalidCheckpoint(f'Invalid checkpoint: {ex}')
+    return checkpoint
+
+'''
+    Reads a full checkpoint and its deltas from files
+'''
+def load_files(path, *delta_paths):
+    def read(path):
+        with open(path, 'rb') as file:
+            return file.read()
+    return load(read(path), *(read(delta_path) for delta_path in delta_paths))
+
+'''
+    Creates a device from its state, without notifying anyone
+'''
+def build_device(state):
+    device_type = DEVICE_CLASSES.get(state.type)
+    if device_type is None:
+        raise InvalidCheckpoint(f'Unknown device type: {state.type}')
+    if device_type is SmartLight:
+        device = SmartLight(state.id, state.name, state.brightness)
+    elif device_type is Thermostat:
+        device = Thermostat(state.id, state.name, state.temperature)
+        device.set_desired_temp(state.desired_temp)
+    else:
+        device = SecurityCamera(state.id, state.name, state.security_status)
+    device.set_status(state.status)
+    return device
+
+'''
+    Creates a new system in the state of a checkpoint
+    By default the clock runs at maximum speed from the time of the checkpoint, and the seed is the one of the
+    checkpointed system; pass another seed to fork a different experiment from the same state
+'''
+def restore(checkpoint, clock=None, seed=None, automations=None):
+    system = AutomationSystem(clock if clock else Clock(Clock.MAX_SPEED, checkpoint.time),
+                              max_devices=checkpoint.max_devices, log_capacity=checkpoint.log_capacity,
+                              seed=checkpoint.seed if seed is None else seed,
+                              rng_batch_size=checkpoint.rng_batch_size, automations=automations)
+    system.log_store.restore(LogEntry(*log) for log in checkpoint.logs)
+    system.add_devices((build_device(state) for state in checkpoint.devices.values()), log=False)
+    system.device_id_count = checkpoint.device_id_count
+    return system
@@ -0,0 +1,81 @@
+from datetime import datetime
+import asyncio
+import time
+
+'''
+    Simulation clock which every device, rule and log timestamp reads the time from
+
+    The clock runs in real time (speed 1), N times faster than real time (speed N),
+    or at maximum speed (speed None), when it never sleeps and jumps straight to the next event.
+    Times are seconds since the epoch, so they can be formatted as dates.
+'''
+class Clock:
+    '''
+        Exception which can be raised when an invalid speed was given
+    '''
+    class IllegalSpeed(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    REAL_TIME = 1
+    MAX_SPEED = None
+
+    def __init__(self, speed=REAL_TIME, start=None):
+        if speed is not None and speed <= 0:
+            raise self.IllegalSpeed('Speed must be positive, or None for maximum speed.')
+        self.__speed = speed
+        self.__start = time.time() if start is None else start
+        self.__wall_start = time.monotonic()
+        self.__virtual_now = self.__start
+
+    '''
+        Returns the speed-up of the clock, None if it runs at maximum speed
+    '''
+    def get_speed(self):
+        return self.__speed
+
+    '''
+        Returns true if the clock never sleeps
+    '''
+    def is_max_speed(self):
+        return self.__speed is None
+
+    '''
+        Returns the current simulated time in seconds since the epoch
+    '''
+    def now(self):
+        if self.__speed is None:
+            return self.__virtual_now
+        return self.__start + (time.monotonic() - self.__wall_start) * self.__speed
+
+    '''
+        Returns the current simulated time as a datetime
+    '''
+    def datetime(self):
+        return datetime.fromtimestamp(self.now())
+
+    '''
+        Waits until the given simulated time, or until the wakeup event is set
+        At maximum speed the clock jumps to the given time instead of sleeping
+    '''
+    def wait_until(self, when, wakeup):
+        if self.__speed is None:
+            self.__virtual_now = max(self.__virtual_now, when)
+            return
+        delay = (when - self.now()) / self.__speed
+        if delay > 0:
+            wakeup.wait(delay)
+
+    '''
+        Coroutine version of wait_until, the wakeup is an asyncio event
+    '''
+    async def wait_until_async(self, when, wakeup):
+        if self.__speed is None:
+            self.__virtual_now = max(self.__virtual_now, when)
+            return
+        delay = (when - self.now()) / self.__speed
+        if delay > 0:
+            try:
+                await asyncio.wait_for(wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
@@ -1,26 +1,32 @@
 from abc import ABC, abstractmethod
-from enum import Enum
-import time
-import random
+from enum import IntEnum
+
+from smarthome.events import *
+from smarthome.ramp import *
 
 '''
     Enumeration representing a power state
+    Small-int enumerations, so they can also be stored as plain integers (e.g. in NumPy columns)
 '''
-class Status(Enum):
+class Status(IntEnum):
     OFF = 1
     ON = 2
 
 '''
     Enumeration representing a security camera state
 '''
-class SecurityStatus(Enum):
+class SecurityStatus(IntEnum):
     SAFE = 1
     ALERT = 2
 
 '''
     Abstract device class for smart devices
+    Devices are slotted, fixed-layout objects without a __dict__, since a home can have hundreds of thousands of them.
+    The default name is not stored, it is computed from the id when it is read
 '''
 class Device(ABC):
+    __slots__ = ('__status', '__id', '__name')
+
     '''
         Exception which can be raised when an illegal argument was given
     '''
@@ -33,10 +39,7 @@ class Device(ABC):
             raise self.IllegalParameter('ID must be non-negative.')
         self.__status = Status.OFF
         self.__id = id
-        if name:
-            self.__name = name
-        else:
-            self.__name = f'Device #{id}'
+        self.__name = name if name else None
 
     '''
         Returns the id of the device
@@ -54,32 +57,54 @@ class Device(ABC):
         Returns the name of the device
     '''
     def get_name(self):
+        if self.__name is None:
+            return f'Device #{self.__id}'
         return self.__name
     
     '''
         Sets a new name for the device
     '''
     def set_name(self, name):
-        self.__name = name
+        self.__name = name if name else None
     
+    '''
+        Sets the power status without notifying anyone
+        Only for devices which are not added to a system yet, e.g. when they are provisioned in bulk
+    '''
+    def set_status(self, status):
+        self.__status = status
+
     '''
         Turns on the device
     '''
     def turn_on(self, system):
-        if self.__status == Status.OFF:
-            self.__status = Status.ON
-            system.add_log(f'{self.get_name()} turned ON')
+        with system.lock:
+            if self.__status == Status.OFF:
+                self.__status = Status.ON
+                system.add_log(f'{self.get_name()} turned ON', self, EventType.STATUS_CHANGED, Status.ON)
+                system.publish(EventType.STATUS_CHANGED, self, Status.ON)
 
     '''
         Turns off the device
     '''
     def turn_off(self, system):
-        if self.__status == Status.ON:
-            self.__status = Status.OFF
-            system.add_log(f'{self.get_name()} turned OFF')
+        with system.lock:
+            if self.__status == Status.ON:
+                self.__status = Status.OFF
+                system.add_log(f'{self.get_name()} turned OFF', self, EventType.STATUS_CHANGED, Status.OFF)
+                system.publish(EventType.STATUS_CHANGED, self, Status.OFF)
+                self.interrupt(system)
+
+    '''
+        Stops what the device is doing in the background (e.g. an analytic ramp), when it is turned off
+    '''
+    def interrupt(self, system):
+        pass
 
     '''
         Abstract method for running the simulation of a device
+        Generator which yields the delays (in seconds) between the steps of the simulation
+        Returns true if the run was successful, false otherwise
     '''
     @abstractmethod
     def run_simulation(self, system):
@@ -89,20 +114,25 @@ class Device(ABC):
     Class representing a smart light
 '''
 class SmartLight(Device):
+    __slots__ = ('__brightness', '__ramp')
     MIN_BRIGHTNESS = 1
     MAX_BRIGHTNESS = 100 
     DEFAULT_BRIGHTNESS = 50
+    DIMMING_STEP_TIME = 0.05
 
     def __init__(self, id, name=None, brightness=DEFAULT_BRIGHTNESS):
         if brightness < 1 or brightness > 100:
             raise super().IllegalParameter('Brightness must be between 1 and 100.')
         super().__init__(id, name)
         self.__brightness = brightness
+        self.__ramp = None
 
     '''
         Returns the current brightness level of the light
     '''
     def get_brightness(self):
+        if self.__ramp:
+            return self.__ramp.value()
         return self.__brightness
     
     '''
@@ -112,24 +142,48 @@ class SmartLight(Device):
     def set_brightness(self, system, new_brightness):
          if new_brightness < self.MIN_BRIGHTNESS or new_brightness > self.MAX_BRIGHTNESS:
             raise super().IllegalParameter(f'Brightness must be between {self.MIN_BRIGHTNESS} and {self.MAX_BRIGHTNESS}')
-         self.__brightness = new_brightness
-         system.add_log(f'{self.get_name()}: Brigthness set to {new_brightness}%')
+         with system.lock:
+            self.__brightness = new_brightness
+            if self.__ramp:
+                self.__ramp = self.__ramp.rebase(new_brightness)
+            system.add_log(f'{self.get_name()}: Brigthness set to {new_brightness}%', self, EventType.BRIGHTNESS_CHANGED, new_brightness)
+            system.publish(EventType.BRIGHTNESS_CHANGED, self, new_brightness)
 
     '''
         Sets the brightness level gradually. This method is part of the simulation
         Sends a message to the system
     '''
     def __gradual_dimming(self, system, new_brightness):
-        system.add_log(f'{self.get_name()}: Changing brightness to {new_brightness}%...')
+        system.add_log(f'{self.get_name()}: Changing brightness to {new_brightness}%...', self)
         while self.get_status() == Status.ON and self.__brightness != new_brightness:
             if new_brightness > self.__brightness:
                 self.__brightness += 1
-                time.sleep(0.05)
             elif new_brightness < self.__brightness:
                 self.__brightness -= 1
-                time.sleep(0.05)
-        system.add_log(f'{self.get_name()}: Brightness set to {new_brightness}%')
+            system.publish(EventType.BRIGHTNESS_CHANGED, self, self.__brightness)
+            yield self.DIMMING_STEP_TIME
+        system.add_log(f'{self.get_name()}: Brightness set to {new_brightness}%', self, EventType.BRIGHTNESS_CHANGED, new_brightness)
+
+    '''
+        Same as the gradual dimming, with an analytic ramp: a single event when the dimming ends
+    '''
+    def __analytic_dimming(self, system, new_brightness):
+        system.add_log(f'{self.get_name()}: Changing brightness to {new_brightness}%...', self)
+        if self.__brightness != new_brightness:
+            self.__ramp = Ramp(system, self, self.__brightness, new_brightness, system.clock.now(),
+                               self.DIMMING_STEP_TIME, self.DIMMING_STEP_TIME, self.__end_ramp)
+            yield self.__ramp.signal
+        system.add_log(f'{self.get_name()}: Brightness set to {new_brightness}%', self, EventType.BRIGHTNESS_CHANGED, new_brightness)
 
+    def __end_ramp(self, ramp, brightness):
+        if self.__ramp is ramp:
+            self.__ramp = None
+            self.__brightness = brightness
+            ramp.system.publish(EventType.BRIGHTNESS_CHANGED, self, brightness)
+
+    def interrupt(self, system):
+        if self.__ramp:
+            self.__ramp.interrupt()
 
     '''
         Runs a randomised simulation for the light, if possible
@@ -138,28 +192,38 @@ class SmartLight(Device):
     def run_simulation(self, system):
         if self.get_status() == Status.OFF:
             return False
-        new_brightness = random.randint(1, 100)
-        self.__gradual_dimming(system, new_brightness)
+        new_brightness = system.get_random(self).randint(1, 100)
+        if system.time_skipping:
+            yield from self.__analytic_dimming(system, new_brightness)
+        else:
+            yield from self.__gradual_dimming(system, new_brightness)
         return True
 
 '''
     Class representing a smart thermostat
 '''
 class Thermostat(Device):
+    __slots__ = ('__temperature', '__desired_temp', '__ramp')
     MIN_TEMP = -10
     MAX_TEMP = 30
     DEFAULT_TEMP = 15
+    HEATING_STEP_TIME = 1
+    COOLING_STEP_TIME = 0.5
 
     def __init__(self, id, name=None, temperature=DEFAULT_TEMP):
         if temperature < self.MIN_TEMP or temperature > self.MAX_TEMP:
             raise super().IllegalParameter(f'Temperature must be between {self.MIN_TEMP} and {self.MAX_TEMP}.')
         super().__init__(id, name)
         self.__temperature = temperature
+        self.__desired_temp = None
+        self.__ramp = None
 
     '''
         Returns the current temperature
     '''
     def get_temperature(self):
+        if self.__ramp:
+            return self.__ramp.value()
         return self.__temperature
     
     '''
@@ -169,8 +233,12 @@ class Thermostat(Device):
     def set_temperature(self, system, temperature):
         if temperature < self.MIN_TEMP or temperature > self.MAX_TEMP:
             raise super().IllegalParameter('Temperature must be between {self.__MIN_TEMP} and {self.__MAX_TEMP}.')
-        self.__temperature = temperature    
-        system.add_log(f'{self.get_name()}: Temperature set to {self.__temperature}°C') 
+        with system.lock:
+            self.__temperature = temperature    
+            if self.__ramp:
+                self.__ramp = self.__ramp.rebase(temperature)
+            system.add_log(f'{self.get_name()}: Temperature set to {self.__temperature}°C', self, EventType.TEMPERATURE_CHANGED, self.__temperature) 
+            system.publish(EventType.TEMPERATURE_CHANGED, self, self.__temperature)
 
     '''
         Returns the current desired temperature
@@ -190,17 +258,45 @@ class Thermostat(Device):
         This method is part of the simulation
     '''
     def __start(self, system, desired_temp):
-        system.add_log(f'{self.get_name()}: Desired temperature set to {desired_temp}°C')
+        self.__desired_temp = desired_temp
+        system.add_log(f'{self.get_name()}: Desired temperature set to {desired_temp}°C', self, EventType.DESIRED_TEMP_CHANGED, desired_temp)
+        system.publish(EventType.DESIRED_TEMP_CHANGED, self, desired_temp)
         while self.get_status() == Status.ON and self.__temperature != desired_temp:
             if desired_temp > self.__temperature:
                 self.__temperature += 1
-                time.sleep(1)
+                system.publish(EventType.TEMPERATURE_CHANGED, self, self.__temperature)
+                yield self.HEATING_STEP_TIME
             elif desired_temp < self.__temperature:
                 self.__temperature -= 1
-                time.sleep(0.5)
-        system.add_log(f'{self.get_name()}: Desired temperature reached. Turning off...')
+                system.publish(EventType.TEMPERATURE_CHANGED, self, self.__temperature)
+                yield self.COOLING_STEP_TIME
+        system.add_log(f'{self.get_name()}: Desired temperature reached. Turning off...', self)
+        self.turn_off(system)
+
+    '''
+        Same as the gradual heating or cooling, with an analytic ramp: a single event when the temperature is reached
+    '''
+    def __analytic_start(self, system, desired_temp):
+        self.__desired_temp = desired_temp
+        system.add_log(f'{self.get_name()}: Desired temperature set to {desired_temp}°C', self, EventType.DESIRED_TEMP_CHANGED, desired_temp)
+        system.publish(EventType.DESIRED_TEMP_CHANGED, self, desired_temp)
+        if self.get_status() == Status.ON and self.__temperature != desired_temp:
+            self.__ramp = Ramp(system, self, self.__temperature, desired_temp, system.clock.now(),
+                               self.HEATING_STEP_TIME, self.COOLING_STEP_TIME, self.__end_ramp)
+            yield self.__ramp.signal
+        system.add_log(f'{self.get_name()}: Desired temperature reached. Turning off...', self)
         self.turn_off(system)
 
+    def __end_ramp(self, ramp, temperature):
+        if self.__ramp is ramp:
+            self.__ramp = None
+            self.__temperature = temperature
+            ramp.system.publish(EventType.TEMPERATURE_CHANGED, self, temperature)
+
+    def interrupt(self, system):
+        if self.__ramp:
+            self.__ramp.interrupt()
+
     '''
         Runs a randomised simulation of the thermostat, if possible
         Returns true if the run was successful, false otherwise
@@ -208,17 +304,21 @@ class Thermostat(Device):
     def run_simulation(self, system):
         if self.get_status() == Status.OFF:
             return False
-        desired_temp = random.randint(-10, 30)
-        self.__start(system, desired_temp)
+        desired_temp = system.get_random(self).randint(-10, 30)
+        if system.time_skipping:
+            yield from self.__analytic_start(system, desired_temp)
+        else:
+            yield from self.__start(system, desired_temp)
         return True
 
 '''
     Class representing a smart security camera
 '''
 class SecurityCamera(Device):
-    def __init__(self, id, name=None):
+    __slots__ = ('__security_status',)
+    def __init__(self, id, name=None, security_status=SecurityStatus.SAFE):
         super().__init__(id, name)
-        self.__security_status = SecurityStatus.SAFE
+        self.__security_status = security_status
 
     '''
         Returns the current security status
@@ -229,11 +329,12 @@ class SecurityCamera(Device):
     '''
         Sets the current security status to the given status
         Sends a message to the system
-        Part of the simulation
     '''
-    def __set_security_status(self, system, security_status):
-        self.__security_status = security_status
-        system.add_log(f'{self.get_name()}: Security status changed: {self.__security_status.name}')
+    def set_security_status(self, system, security_status):
+        with system.lock:
+            self.__security_status = security_status
+            system.add_log(f'{self.get_name()}: Security status changed: {self.__security_status.name}', self, EventType.SECURITY_STATUS_CHANGED, security_status)
+            system.publish(EventType.SECURITY_STATUS_CHANGED, self, security_status)
 
     '''
         Runs a randomised simulation of the device
@@ -243,10 +344,10 @@ class SecurityCamera(Device):
     def run_simulation(self, system):
         if self.get_status() == Status.OFF:
             return False
-        sim_length = random.randint(1, 10)
+        sim_length = system.get_random(self).randint(1, 10)
 
-        self.__set_security_status(system, SecurityStatus.ALERT)
+        self.set_security_status(system, SecurityStatus.ALERT)
 
-        time.sleep(sim_length)
-        self.__set_security_status(system, SecurityStatus.SAFE)
+        yield sim_length
+        self.set_security_status(system, SecurityStatus.SAFE)
         return True
\ No newline at end of file
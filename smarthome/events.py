@@ -0,0 +1,77 @@
+from enum import Enum
+
+'''
+    Enumeration representing the kinds of state changes a device can emit
+'''
+class EventType(Enum):
+    DEVICE_ADDED = 1
+    DEVICE_REMOVED = 2
+    STATUS_CHANGED = 3
+    BRIGHTNESS_CHANGED = 4
+    TEMPERATURE_CHANGED = 5
+    DESIRED_TEMP_CHANGED = 6
+    SECURITY_STATUS_CHANGED = 7
+
+'''
+    A state change of a device: its type, the device, the new value and the simulated time it happened
+'''
+class StateChange:
+    def __init__(self, event_type, device, value, time):
+        self.event_type = event_type
+        self.device = device
+        self.value = value
+        self.time = time
+
+'''
+    Publish-subscribe bus for device state changes
+    Subscribers are only called for the event types they subscribed to,
+    and nothing is created for an event type nobody listens to
+'''
+class EventBus:
+    def __init__(self, clock):
+        self.__clock = clock
+        self.__subscribers = {event_type: [] for event_type in EventType}
+
+    '''
+        Subscribes a handler, it is called with the StateChange every time an event of the given type is published
+    '''
+    def subscribe(self, event_type, handler):
+        self.__subscribers[event_type].append(handler)
+
+    '''
+        Removes a previously subscribed handler
+    '''
+    def unsubscribe(self, event_type, handler):
+        if handler in self.__subscribers[event_type]:
+            self.__subscribers[event_type].remove(handler)
+
+    '''
+        Returns true if anybody listens to the given event type
+    '''
+    def has_subscribers(self, event_type):
+        return bool(self.__subscribers[event_type])
+
+    '''
+        Delivers a state change to the handlers subscribed to its type
+    '''
+    def publish(self, event_type, device, value):
+        handlers = self.__subscribers[event_type]
+        if not handlers:
+            return
+        event = StateChange(event_type, device, value, self.__clock.now())
+        for handler in tuple(handlers):
+            handler(event)
+
+    '''
+        Delivers the same change of many devices (e.g. devices added in bulk), at the same time,
+        reading the handlers and the clock once
+    '''
+    def publish_many(self, event_type, devices, value):
+        handlers = tuple(self.__subscribers[event_type])
+        if not handlers:
+            return
+        now = self.__clock.now()
+        for device in devices:
+            event = StateChange(event_type, device, value, now)
+            for handler in handlers:
+                handler(event)
@@ -0,0 +1,360 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from smarthome.devices import *
+from smarthome.events import *
+from smarthome.scheduler import *
+
+'''
+    Columnar storage for the state of every device of one type
+    Every column is a contiguous NumPy array, a device owns one row of each column
+'''
+class ColumnTable:
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, columns, capacity=INITIAL_CAPACITY):
+        self.__dtypes = columns
+        self.__capacity = max(capacity, 1)
+        for column, dtype in columns.items():
+            setattr(self, column, np.zeros(self.__capacity, dtype=dtype))
+        self.size = 0
+        self.views = [None] * self.__capacity
+        self.__free_rows = []
+
+    '''
+        Doubles the capacity of every column
+    '''
+    def __grow(self):
+        capacity = self.__capacity * 2
+        for column, dtype in self.__dtypes.items():
+            grown = np.zeros(capacity, dtype=dtype)
+            grown[:self.__capacity] = getattr(self, column)
+            setattr(self, column, grown)
+        self.views.extend([None] * (capacity - self.__capacity))
+        self.__capacity = capacity
+
+    '''
+        Allocates a row for a device view and returns its index
+    '''
+    def allocate(self, view):
+        if self.__free_rows:
+            row = self.__free_rows.pop()
+        else:
+            if self.size == self.__capacity:
+                self.__grow()
+            row = self.size
+            self.size += 1
+        for column in self.__dtypes:
+            getattr(self, column)[row] = 0
+        self.views[row] = view
+        return row
+
+    '''
+        Frees the row of a device, it can be reused by a new device
+    '''
+    def release(self, row):
+        self.views[row] = None
+        self.__free_rows.append(row)
+
+'''
+    Columnar table of devices with a value which is ramped towards a target one unit at a time,
+    like the brightness of lights or the temperature of thermostats
+
+    Every ramp in the table is advanced by one vectorized operation per tick, instead of
+    one Python loop iteration per device and per unit
+    A tick runs whenever the next step of a ramp is due, so every step happens at the time the device would make it
+'''
+class RampTable(ColumnTable):
+    EPSILON = 1e-9
+
+    def __init__(self, system, event_type, step_up_time, step_down_time, capacity=ColumnTable.INITIAL_CAPACITY):
+        super().__init__({
+            'status': np.int8,
+            'value': np.int16,
+            'target': np.int16,
+            'ramping': np.bool_,
+            'next_step': np.float64,
+        }, capacity)
+        self.__system = system
+        self.__event_type = event_type
+        self.__step_up_time = step_up_time
+        self.__step_down_time = step_down_time
+        self.__signals = {}
+        self.__tick_timer = None
+
+    '''
+        Starts ramping the value of a row towards the target
+        Returns a signal which fires when the ramp is finished or interrupted
+    '''
+    def start_ramp(self, row, target):
+        signal = self.__signals.pop(row, None)
+        if signal:
+            signal.fire()
+        signal = Signal()
+        self.__signals[row] = signal
+        self.target[row] = target
+        self.ramping[row] = True
+        now = self.__system.scheduler.now()
+        self.next_step[row] = now
+        self.__schedule_tick(now)
+        return signal
+
+    '''
+        Makes sure a tick runs at the given time, ticks only run when a step is due
+    '''
+    def __schedule_tick(self, when):
+        timer = self.__tick_timer
+        if timer is not None and timer.scheduler is not None:
+            if timer.when <= when + self.EPSILON:
+                return
+            timer.cancel()
+        self.__tick_timer = self.__system.scheduler.schedule_at(when, self.__tick)
+
+    '''
+        Abandons every ramp, e.g. when the simulation stops: the scheduler drops the tick and the processes
+        waiting for the ramps, so their signals are dropped without being fired
+    '''
+    def reset(self):
+        if self.__tick_timer is not None:
+            self.__tick_timer.cancel()
+            self.__tick_timer = None
+        self.__signals.clear()
+        self.ramping[:] = False
+
+    '''
+        Advances every ramp in the table by one step
+        A ramp is finished when the device is turned off, or once it has reached its target and the time of the last step
+        is over, like the stepped ramp of a device, which waits for the step time after every step
+    '''
+    def __tick(self):
+        self.__tick_timer = None
+        n = self.size
+        now = self.__system.scheduler.now()
+        ramping = self.ramping[:n]
+        value = self.value[:n]
+        target = self.target[:n]
+        next_step = self.next_step[:n]
+
+        due = ramping & (next_step <= now + self.EPSILON)
+        finished = ramping & ((due & (value == target)) | (self.status[:n] != Status.ON.value))
+        due &= ~finished
+        rising = due & (target > value)
+        falling = due & (target < value)
+        value[rising] += 1
+        value[falling] -= 1
+        next_step[rising] += self.__step_up_time
+        next_step[falling] += self.__step_down_time
+
+        stepped = np.flatnonzero(rising | falling)
+        if self.__system.events.has_subscribers(self.__event_type):
+            for row in stepped:
+                self.__system.publish(self.__event_type, self.views[row], int(value[row]))
+        elif len(stepped):
+            self.__system.mark_changed(self.views[row] for row in stepped)
+
+        ramping[finished] = False
+        for row in np.flatnonzero(finished):
+            self.__signals.pop(row).fire()
+
+        if ramping.any():
+            self.__schedule_tick(float(next_step[ramping].min()))
+
+    def release(self, row):
+        signal = self.__signals.pop(row, None)
+        if signal:
+            signal.fire()
+        self.ramping[row] = False
+        super().release(row)
+
+'''
+    Base of the device views: the power status of the device lives in its row of the table
+    Views are slotted like the devices, they only add their table and their row
+'''
+class FleetDevice:
+    __slots__ = ()
+    def get_status(self):
+        return Status(int(self.table.status[self.row]))
+
+    def set_status(self, status):
+        self.table.status[self.row] = status.value
+
+    def turn_on(self, system):
+        with system.lock:
+            if self.get_status() == Status.OFF:
+                self.table.status[self.row] = Status.ON.value
+                system.add_log(f'{self.get_name()} turned ON', self, EventType.STATUS_CHANGED, Status.ON)
+                system.publish(EventType.STATUS_CHANGED, self, Status.ON)
+
+    def turn_off(self, system):
+        with system.lock:
+            if self.get_status() == Status.ON:
+                self.table.status[self.row] = Status.OFF.value
+                system.add_log(f'{self.get_name()} turned OFF', self, EventType.STATUS_CHANGED, Status.OFF)
+                system.publish(EventType.STATUS_CHANGED, self, Status.OFF)
+
+'''
+    Smart light whose state lives in a row of the fleet's light table
+'''
+class FleetSmartLight(FleetDevice, SmartLight):
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, id, name=None, brightness=SmartLight.DEFAULT_BRIGHTNESS):
+        super().__init__(id, name, brightness)
+        self.table = table
+        self.row = table.allocate(self)
+        table.status[self.row] = Status.OFF.value
+        table.value[self.row] = brightness
+
+    def get_brightness(self):
+        return int(self.table.value[self.row])
+
+    def set_brightness(self, system, new_brightness):
+        if new_brightness < self.MIN_BRIGHTNESS or new_brightness > self.MAX_BRIGHTNESS:
+            raise Device.IllegalParameter(f'Brightness must be between {self.MIN_BRIGHTNESS} and {self.MAX_BRIGHTNESS}')
+        with system.lock:
+            self.table.value[self.row] = new_brightness
+            system.add_log(f'{self.get_name()}: Brigthness set to {new_brightness}%', self, EventType.BRIGHTNESS_CHANGED, new_brightness)
+            system.publish(EventType.BRIGHTNESS_CHANGED, self, new_brightness)
+
+    '''
+        Runs a randomised simulation for the light, the dimming is stepped by the fleet
+    '''
+    def run_simulation(self, system):
+        if self.get_status() == Status.OFF:
+            return False
+        new_brightness = system.get_random(self).randint(1, 100)
+        system.add_log(f'{self.get_name()}: Changing brightness to {new_brightness}%...', self)
+        yield self.table.start_ramp(self.row, new_brightness)
+        system.add_log(f'{self.get_name()}: Brightness set to {new_brightness}%', self, EventType.BRIGHTNESS_CHANGED, new_brightness)
+        return True
+
+'''
+    Thermostat whose state lives in a row of the fleet's thermostat table
+'''
+class FleetThermostat(FleetDevice, Thermostat):
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, id, name=None, temperature=Thermostat.DEFAULT_TEMP):
+        super().__init__(id, name, temperature)
+        self.table = table
+        self.row = table.allocate(self)
+        table.status[self.row] = Status.OFF.value
+        table.value[self.row] = temperature
+        table.target[self.row] = temperature
+
+    def get_temperature(self):
+        return int(self.table.value[self.row])
+
+    def set_temperature(self, system, temperature):
+        if temperature < self.MIN_TEMP or temperature > self.MAX_TEMP:
+            raise Device.IllegalParameter(f'Temperature must be between {self.MIN_TEMP} and {self.MAX_TEMP}.')
+        with system.lock:
+            self.table.value[self.row] = temperature
+            system.add_log(f'{self.get_name()}: Temperature set to {temperature}°C', self, EventType.TEMPERATURE_CHANGED, temperature)
+            system.publish(EventType.TEMPERATURE_CHANGED, self, temperature)
+
+    def get_desired_temp(self):
+        return int(self.table.target[self.row])
+
+    def set_desired_temp(self, desired_temp):
+        self.table.target[self.row] = desired_temp
+
+    '''
+        Runs a randomised simulation of the thermostat, the heating or cooling is stepped by the fleet
+    '''
+    def run_simulation(self, system):
+        if self.get_status() == Status.OFF:
+            return False
+        desired_temp = system.get_random(self).randint(-10, 30)
+        system.add_log(f'{self.get_name()}: Desired temperature set to {desired_temp}°C', self, EventType.DESIRED_TEMP_CHANGED, desired_temp)
+        system.publish(EventType.DESIRED_TEMP_CHANGED, self, desired_temp)
+        yield self.table.start_ramp(self.row, desired_temp)
+        system.add_log(f'{self.get_name()}: Desired temperature reached. Turning off...', self)
+        self.turn_off(system)
+        return True
+
+'''
+    Security camera whose state lives in a row of the fleet's camera table
+'''
+class FleetSecurityCamera(FleetDevice, SecurityCamera):
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, id, name=None):
+        super().__init__(id, name)
+        self.table = table
+        self.row = table.allocate(self)
+        table.status[self.row] = Status.OFF.value
+        table.security_status[self.row] = SecurityStatus.SAFE.value
+
+    def get_security_status(self):
+        return SecurityStatus(int(self.table.security_status[self.row]))
+
+    def set_security_status(self, system, security_status):
+        with system.lock:
+            self.table.security_status[self.row] = security_status.value
+            system.add_log(f'{self.get_name()}: Security status changed: {security_status.name}', self, EventType.SECURITY_STATUS_CHANGED, security_status)
+            system.publish(EventType.SECURITY_STATUS_CHANGED, self, security_status)
+
+    def run_simulation(self, system):
+        if self.get_status() == Status.OFF:
+            return False
+        sim_length = system.get_random(self).randint(1, 10)
+        self.set_security_status(system, SecurityStatus.ALERT)
+        yield sim_length
+        self.set_security_status(system, SecurityStatus.SAFE)
+        return True
+
+'''
+    Optional fleet mode for large simulations (requires NumPy)
+
+    The state of every device of a type lives in contiguous arrays, and the brightness and
+    temperature ramps of all devices are advanced together in vectorized ticks.
+    The devices it creates are thin views over their rows, so they can be used like any other device.
+'''
+class Fleet:
+    '''
+        Exception which can be raised when NumPy is not installed
+    '''
+    class NumPyMissing(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    def __init__(self, system, capacity=ColumnTable.INITIAL_CAPACITY):
+        if np is None:
+            raise self.NumPyMissing('Fleet mode requires NumPy to be installed')
+        self.lights = RampTable(system, EventType.BRIGHTNESS_CHANGED,
+                                SmartLight.DIMMING_STEP_TIME, SmartLight.DIMMING_STEP_TIME, capacity)
+        self.thermostats = RampTable(system, EventType.TEMPERATURE_CHANGED,
+                                     Thermostat.HEATING_STEP_TIME, Thermostat.COOLING_STEP_TIME, capacity)
+        self.cameras = ColumnTable({'status': np.int8, 'security_status': np.int8}, capacity)
+        system.events.subscribe(EventType.DEVICE_REMOVED, self.__on_device_removed)
+        system.add_simulation_hooks(self.__reset, self.__reset)
+
+    '''
+        Creates a device of the given type, backed by a row of the fleet
+        The device still has to be added to the system
+    '''
+    def create_device(self, device_type, id, name=None):
+        if issubclass(device_type, SmartLight):
+            return FleetSmartLight(self.lights, id, name)
+        if issubclass(device_type, Thermostat):
+            return FleetThermostat(self.thermostats, id, name)
+        if issubclass(device_type, SecurityCamera):
+            return FleetSecurityCamera(self.cameras, id, name)
+        raise ValueError(f'Unknown device type: {device_type.__name__}')
+
+    '''
+        Abandons the ramps of the previous simulation, when a simulation starts or stops
+    '''
+    def __reset(self, system):
+        self.lights.reset()
+        self.thermostats.reset()
+
+    '''
+        Frees the row of a device removed from the system
+    '''
+    def __on_device_removed(self, event):
+        if isinstance(event.device, FleetDevice):
+            event.device.table.release(event.device.row)
@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import struct
+import sys
+
+from smarthome.scenario import *
+
+'''
+    Telemetry ingest server: external or emulated devices (e.g. load generators in other processes)
+    feed the state of the devices of a system over TCP
+
+    Every message is a frame: a header (kind, payload length) followed by the payload.
+    UPDATES frames carry fixed-size records (device id, attribute code, value), 7 bytes each;
+    a PROVISION frame asks for new devices (type code, count, status) and is answered with a PROVISIONED frame
+    (first id, count; a count of 0 if the devices could not be added).
+    The frames are decoded in batches and the updates of several frames are applied in bulk, by the same methods
+    the simulation uses, so the rules and the logs react exactly as they do for simulated devices.
+    The lock of the system is held for at most MAX_RECORDS_PER_LOCK updates at once and released between them,
+    so the timers of the automations, dispatched on the event loop under that lock, are not held up by a large batch.
+    Updates for unknown devices, or which do not apply to the device, are rejected and counted.
+    The frames waiting to be applied are bounded: when the queue is full the server stops reading,
+    so the TCP window fills up and the writers of the clients wait (backpressure).
+    The automations only react while the system runs, e.g. with run_simulation_async(simulate_devices=False).
+
+    Usage: python -m smarthome.ingest [--scenario FILE] [--host HOST] [--port PORT] [--duration SECONDS]
+'''
+
+HEADER = struct.Struct('!BI')
+UPDATE = struct.Struct('!IBh')
+PROVISION = struct.Struct('!BIB')
+PROVISIONED = struct.Struct('!II')
+
+UPDATES = 1
+PROVISION_DEVICES = 2
+PROVISIONED_DEVICES = 3
+
+'''
+    Codes of the attributes which can be updated, and of the device types which can be provisioned
+'''
+ATTRIBUTE_CODES = {
+    'status': 1,
+    'brightness': 2,
+    'temperature': 3,
+    'security_status': 4,
+}
+
+DEVICE_TYPE_CODES = {
+    SmartLight: 1,
+    Thermostat: 2,
+    SecurityCamera: 3,
+}
+
+DEVICE_TYPES_BY_CODE = {code: device_type for device_type, code in DEVICE_TYPE_CODES.items()}
+
+'''
+    Turns a device on or off
+'''
+def apply_status(system, device, value):
+    if Status(value) == Status.ON:
+        device.turn_on(system)
+    else:
+        device.turn_off(system)
+
+'''
+    Functions applying an update to a device, by attribute code
+    They raise AttributeError if the attribute does not apply to the device, ValueError if the value is not valid
+'''
+UPDATE_APPLIERS = {
+    ATTRIBUTE_CODES['status']: apply_status,
+    ATTRIBUTE_CODES['brightness']: lambda system, device, value: device.set_brightness(system, value),
+    ATTRIBUTE_CODES['temperature']: lambda system, device, value: device.set_temperature(system, value),
+    ATTRIBUTE_CODES['security_status']: lambda system, device, value: device.set_security_status(system, SecurityStatus(value)),
+}
+
+'''
+    Encodes updates, (device id, attribute name, value) tuples, into UPDATES frames of at most the given number of records
+'''
+def encode_updates(updates, frame_size=None):
+    frame_size = frame_size if frame_size else IngestServer.MAX_FRAME_SIZE // UPDATE.size
+    pack = UPDATE.pack
+    records = [pack(device_id, ATTRIBUTE_CODES[attribute], value) for device_id, attribute, value in updates]
+    frames = []
+    for start in range(0, len(records), frame_size):
+        payload = b''.join(records[start:start + frame_size])
+        frames.append(HEADER.pack(UPDATES, len(payload)) + payload)
+    return b''.join(frames)
+
+'''
+    Server applying the updates received from its clients to a system, on an asyncio event loop
+'''
+class IngestServer:
+    '''
+        Exception which can be raised when a client sends an invalid frame
+    '''
+    class ProtocolError(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    DEFAULT_PORT = 7878
+    MAX_FRAME_SIZE = 1 << 20
+    MAX_PENDING_FRAMES = 64
+    MAX_RECORDS_PER_LOCK = 4096
+
+    def __init__(self, system, host='127.0.0.1', port=DEFAULT_PORT, max_pending_frames=MAX_PENDING_FRAMES,
+                 max_records_per_lock=MAX_RECORDS_PER_LOCK):
+        self.system = system
+        self.host = host
+        self.port = port
+        self.updates_applied = 0
+        self.updates_rejected = 0
+        self.protocol_errors = 0
+        self.__max_pending_frames = max_pending_frames
+        self.__max_records_per_lock = max(max_records_per_lock, 1)
+        self.__queue = None
+        self.__server = None
+        self.__applier = None
+
+    '''
+        Returns the port the server listens on
+    '''
+    def get_port(self):
+        return self.__server.sockets[0].getsockname()[1]
+
+    '''
+        Starts listening and applying the updates
+        Returns the server
+    '''
+    async def start(self):
+        self.__queue = asyncio.Queue(self.__max_pending_frames)
+        self.__applier = asyncio.create_task(self.__apply_loop())
+        self.__server = await asyncio.start_server(self.__handle, self.host, self.port)
+        return self
+
+    '''
+        Stops listening, once the frames already received are applied
+    '''
+    async def stop(self):
+        self.__server.close()
+        await self.__server.wait_closed()
+        await self.__queue.join()
+        self.__applier.cancel()
+
+    '''
+        Reads the frames of a client until it disconnects or sends an invalid frame
+    '''
+    async def __handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                kind, length = HEADER.unpack(header)
+                if length > self.MAX_FRAME_SIZE:
+                    raise self.ProtocolError(f'Frame of {length} bytes is too large')
+                payload = await reader.readexactly(length)
+                if kind == UPDATES:
+                    if length % UPDATE.size:
+                        raise self.ProtocolError('Truncated update')
+                    await self.__queue.put((kind, payload, None))
+                elif kind == PROVISION_DEVICES:
+                    if length != PROVISION.size:
+                        raise self.ProtocolError('Invalid provisioning request')
+                    provisioned = asyncio.get_running_loop().create_future()
+                    await self.__queue.put((kind, payload, provisioned))
+                    first_id, count = await provisioned
+                    writer.write(HEADER.pack(PROVISIONED_DEVICES, PROVISIONED.size) + PROVISIONED.pack(first_id, count))
+                    await writer.drain()
+                else:
+                    raise self.ProtocolError(f'Unknown frame kind: {kind}')
+        except (self.ProtocolError, asyncio.IncompleteReadError):
+            self.protocol_errors += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    '''
+        Applies the queued frames, as many as are waiting in a single step, on a worker thread
+        so the event loop keeps reading meanwhile
+        The frames are applied in chunks of a bounded number of updates, the lock of the system is released
+        and the event loop runs between two chunks (e.g. to dispatch the timers of the automations)
+    '''
+    async def __apply_loop(self):
+        while True:
+            frames = [await self.__queue.get()]
+            while not self.__queue.empty():
+                frames.append(self.__queue.get_nowait())
+            try:
+                for chunk in self.__chunks(frames):
+                    try:
+                        results = await asyncio.to_thread(self.__apply, chunk)
+                    except Exception as ex:
+                        # An automation failed on an update: the other updates of the chunk are lost, the server keeps running
+                        self.system.add_log(f'Ingest failed: {ex!r}')
+                        results = [(0, 0)] * len(chunk)
+                    for (kind, payload, provisioned), result in zip(chunk, results):
+                        if provisioned is not None and not provisioned.done():
+                            provisioned.set_result(result)
+            finally:
+                for _ in frames:
+                    self.__queue.task_done()
+
+    '''
+        Splits frames into chunks of at most max_records_per_lock updates, an UPDATES frame being split
+        at the boundaries of its records
+    '''
+    def __chunks(self, frames):
+        size = self.__max_records_per_lock * UPDATE.size
+        chunk, free = [], size
+        for kind, payload, provisioned in frames:
+            if kind != UPDATES:
+                chunk.append((kind, payload, provisioned))
+                continue
+            payload = memoryview(payload)
+            while payload:
+                if not free:
+                    yield chunk
+                    chunk, free = [], size
+                piece, payload = payload[:free], payload[free:]
+                chunk.append((kind, piece, None))
+                free -= len(piece)
+        if chunk:
+            yield chunk
+
+    '''
+        Applies a chunk of frames holding the lock of the system once
+        Returns the result of every frame: the first id and the count of the provisioned devices, None for updates
+    '''
+    def __apply(self, frames):
+        results = []
+        with self.system.lock:
+            for kind, payload, _ in frames:
+                if kind == UPDATES:
+                    self.__apply_updates(payload)
+                    results.append(None)
+                else:
+                    results.append(self.__provision(payload))
+        return results
+
+    def __apply_updates(self, payload):
+        system = self.system
+        get_device = system.get_device
+        applied = rejected = 0
+        for device_id, code, value in UPDATE.iter_unpack(payload):
+            device = get_device(device_id)
+            apply = UPDATE_APPLIERS.get(code)
+            if device is None or apply is None:
+                rejected += 1
+                continue
+            try:
+                apply(system, device, value)
+                applied += 1
+            except (AttributeError, ValueError, Device.IllegalParameter):
+                rejected += 1
+        self.updates_applied += applied
+        self.updates_rejected += rejected
+
+    def __provision(self, payload):
+        type_code, count, status = PROVISION.unpack(payload)
+        try:
+            devices = self.system.provision(DEVICE_TYPES_BY_CODE[type_code], count, Status(status))
+        except (KeyError, ValueError, AutomationSystem.DeviceLimitReached):
+            return 0, 0
+        return (devices[0].get_id(), len(devices)) if devices else (0, 0)
+
+'''
+    Client of an ingest server, for load generators and device emulators
+'''
+class IngestClient:
+    def __init__(self, host='127.0.0.1', port=IngestServer.DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.__reader = None
+        self.__writer = None
+
+    async def connect(self):
+        self.__reader, self.__writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    '''
+        Asks the server for new devices of a type
+        Returns their ids as a range, empty if they could not be added
+    '''
+    async def provision(self, device_type, count, status=Status.OFF):
+        self.__writer.write(HEADER.pack(PROVISION_DEVICES, PROVISION.size)
+                            + PROVISION.pack(DEVICE_TYPE_CODES[device_type], count, status))
+        await self.__writer.drain()
+        kind, length = HEADER.unpack(await self.__reader.readexactly(HEADER.size))
+        first_id, count = PROVISIONED.unpack(await self.__reader.readexactly(length))
+        return range(first_id, first_id + count)
+
+    '''
+        Sends updates, (device id, attribute name, value) tuples
+        Waits while the server is not keeping up
+    '''
+    async def send(self, updates):
+        await self.send_encoded(encode_updates(updates))
+
+    '''
+        Sends frames encoded by encode_updates, so a load generator can encode them once and send them many times
+    '''
+    async def send_encoded(self, frames):
+        self.__writer.write(frames)
+        await self.__writer.drain()
+
+    async def close(self):
+        self.__writer.close()
+        await self.__writer.wait_closed()
+
+'''
+    Runs an ingest server for the system of a scenario (or an empty one), with its automations and timers,
+    but without simulating its devices
+'''
+async def serve(system, host, port, duration=None):
+    server = await IngestServer(system, host, port).start()
+    print(f'Listening on {host}:{server.get_port()}', file=sys.stderr)
+    try:
+        await system.run_simulation_async(duration, simulate_devices=False)
+    finally:
+        await server.stop()
+    return server
+
+'''
+    Command line entry point
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smarthome.ingest', description='Feeds a system from external devices.')
+    parser.add_argument('--scenario', help='scenario file (JSON or CSV) to create the system and its devices from')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=IngestServer.DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--duration', type=float, help='seconds to run for, forever by default')
+    args = parser.parse_args(argv)
+
+    # External devices report in real time, whatever the speed of the scenario
+    if args.scenario:
+        scenario = load_scenario(args.scenario)
+        scenario.speed = Clock.REAL_TIME
+        system = scenario.build()
+    else:
+        system = AutomationSystem(Clock(Clock.REAL_TIME), max_devices=None)
+    try:
+        server = asyncio.run(serve(system, args.host, args.port, args.duration))
+    except KeyboardInterrupt:
+        return
+    print(f'{server.updates_applied} updates applied, {server.updates_rejected} rejected', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+from enum import Enum
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+
+from smarthome.events import *
+
+'''
+    Append-only on-disk journal of every log entry and device state change of a system
+
+    Records are stored one JSON object per line, in numbered segment files.
+    The simulation thread only queues the records; they are encoded and written in batches
+    by a background thread, and a new segment is started when the current one is full.
+'''
+class Journal:
+    SEGMENT_PREFIX = 'journal-'
+    SEGMENT_SUFFIX = '.jsonl'
+    DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+    DEFAULT_BATCH_SIZE = 1024
+    DEFAULT_FLUSH_INTERVAL = 0.5
+
+    __CLOSE = object()
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.__directory = directory
+        self.__segment_size = segment_size
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__queue = queue.SimpleQueue()
+        self.__system = None
+        os.makedirs(directory, exist_ok=True)
+
+        segments = list_segments(directory)
+        self.__segment_number = segment_number(segments[-1]) + 1 if segments else 1
+        self.__file = None
+        self.__open_segment()
+
+        self.__writer = threading.Thread(target=self.__write_loop)
+        self.__writer.daemon = True
+        self.__writer.start()
+
+    '''
+        Starts recording the logs and state changes of a system
+    '''
+    def attach(self, system):
+        self.__system = system
+        system.log_store.add_listener(self.record_log)
+        for event_type in EventType:
+            system.events.subscribe(event_type, self.record_state_change)
+
+    '''
+        Stops recording the logs and state changes of the attached system
+    '''
+    def detach(self):
+        if self.__system is None:
+            return
+        self.__system.log_store.remove_listener(self.record_log)
+        for event_type in EventType:
+            self.__system.events.unsubscribe(event_type, self.record_state_change)
+        self.__system = None
+
+    '''
+        Queues a log entry to be written
+    '''
+    def record_log(self, entry):
+        self.__queue.put(('log', entry.time, entry.sequence, entry.message, entry.device_id, entry.event_type, entry.value))
+
+    '''
+        Queues a device state change to be written
+    '''
+    def record_state_change(self, event):
+        self.__queue.put(('state', event.time, None, None, event.device.get_id(), event.event_type, event.value))
+
+    '''
+        Writes the queued records and stops the writer thread
+    '''
+    def close(self):
+        self.detach()
+        self.__queue.put(self.__CLOSE)
+        self.__writer.join()
+
+    def __open_segment(self):
+        if self.__file:
+            self.__file.close()
+        name = f'{self.SEGMENT_PREFIX}{self.__segment_number:08d}{self.SEGMENT_SUFFIX}'
+        self.__file = open(os.path.join(self.__directory, name), 'ab')
+        self.__segment_number += 1
+
+    '''
+        Collects the queued records and writes them in batches, until the journal is closed
+    '''
+    def __write_loop(self):
+        batch = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.__queue.get(timeout=self.__flush_interval)
+            except queue.Empty:
+                record = None
+            if record is self.__CLOSE:
+                self.__write(batch)
+                self.__file.close()
+                return
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= self.__batch_size or (batch and time.monotonic() - last_flush >= self.__flush_interval):
+                self.__write(batch)
+                batch = []
+                last_flush = time.monotonic()
+
+    '''
+        Encodes and appends a batch of records, starting a new segment if the current one is full
+    '''
+    def __write(self, batch):
+        if not batch:
+            return
+        data = ''.join(encode_record(record) for record in batch).encode('utf-8')
+        if self.__file.tell() > 0 and self.__file.tell() + len(data) > self.__segment_size:
+            self.__open_segment()
+        self.__file.write(data)
+        self.__file.flush()
+
+'''
+    Reads the records of a journal lazily, segment by segment
+    Segments are memory-mapped, so histories much larger than the memory can be scanned
+'''
+class JournalReader:
+    def __init__(self, directory):
+        self.__directory = directory
+
+    '''
+        Iterates over the records of every segment in the order they were written
+        Every record is a dict with kind, time, sequence, message, device, event and value keys
+    '''
+    def __iter__(self):
+        for segment in list_segments(self.__directory):
+            path = os.path.join(self.__directory, segment)
+            if os.path.getsize(path) == 0:
+                continue
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for line in iter(mapped.readline, b''):
+                    yield json.loads(line)
+
+'''
+    Returns the names of the journal segments in a directory, oldest first
+'''
+def list_segments(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith(Journal.SEGMENT_PREFIX) and name.endswith(Journal.SEGMENT_SUFFIX))
+
+'''
+    Returns the number of a segment from its name
+'''
+def segment_number(name):
+    return int(name[len(Journal.SEGMENT_PREFIX):-len(Journal.SEGMENT_SUFFIX)])
+
+'''
+    Encodes a queued record as a line of JSON
+'''
+def encode_record(record):
+    kind, time, sequence, message, device_id, event_type, value = record
+    return json.dumps({
+        'kind': kind,
+        'time': time,
+        'sequence': sequence,
+        'message': message,
+        'device': device_id,
+        'event': event_type.name if event_type else None,
+        'value': value.name if isinstance(value, Enum) else value,
+    }, separators=(',', ':')) + '\n'
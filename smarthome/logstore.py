@@ -0,0 +1,134 @@
+from datetime import datetime
+
+'''
+    A log message with its structured fields
+    The timestamp is kept raw and only formatted when the entry is read as text
+'''
+class LogEntry:
+    TIME_FORMAT = "%Y.%m.%d %H:%M:%S"
+
+    def __init__(self, sequence, time, message, device_id=None, event_type=None, value=None):
+        self.sequence = sequence
+        self.time = time
+        self.message = message
+        self.device_id = device_id
+        self.event_type = event_type
+        self.value = value
+
+    '''
+        Returns the entry in YYYY.MM.DD HH:MM:SS - message format
+    '''
+    def format(self):
+        return f'{datetime.fromtimestamp(self.time).strftime(self.TIME_FORMAT)} - {self.message}'
+
+    def __str__(self):
+        return self.format()
+
+'''
+    Fixed-capacity ring buffer of log entries
+    Appending is O(1); when the buffer is full the oldest entry is overwritten.
+    Every entry gets an increasing sequence number, which readers can use as a cursor.
+'''
+class LogStore:
+    DEFAULT_CAPACITY = 10000
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError('Capacity must be positive.')
+        self.__capacity = capacity
+        self.__entries = [None] * capacity
+        self.__next_sequence = 0
+        self.__listeners = []
+
+    '''
+        Returns the maximum number of entries kept
+    '''
+    def get_capacity(self):
+        return self.__capacity
+
+    def __len__(self):
+        return min(self.__next_sequence, self.__capacity)
+
+    '''
+        Returns the sequence number the next entry will get
+    '''
+    def next_sequence(self):
+        return self.__next_sequence
+
+    '''
+        Returns the sequence number of the oldest entry still kept
+    '''
+    def first_sequence(self):
+        return max(0, self.__next_sequence - self.__capacity)
+
+    '''
+        Registers a callback which is called with every new entry
+    '''
+    def add_listener(self, callback):
+        self.__listeners.append(callback)
+
+    '''
+        Removes a previously registered callback
+    '''
+    def remove_listener(self, callback):
+        if callback in self.__listeners:
+            self.__listeners.remove(callback)
+
+    '''
+        Stores a new entry and returns its sequence number
+    '''
+    def append(self, time, message, device_id=None, event_type=None, value=None):
+        sequence = self.__next_sequence
+        entry = LogEntry(sequence, time, message, device_id, event_type, value)
+        self.__entries[sequence % self.__capacity] = entry
+        self.__next_sequence = sequence + 1
+        for listener in self.__listeners:
+            listener(entry)
+        return sequence
+
+    '''
+        Replaces the content of the store with the given entries, oldest first, keeping their sequence numbers
+        The listeners are not called
+    '''
+    def restore(self, entries):
+        self.__entries = [None] * self.__capacity
+        self.__next_sequence = 0
+        for entry in entries:
+            self.__entries[entry.sequence % self.__capacity] = entry
+            self.__next_sequence = entry.sequence + 1
+
+    '''
+        Returns the entry with the given sequence number, None if it has already been overwritten
+    '''
+    def get(self, sequence):
+        if sequence < self.first_sequence() or sequence >= self.__next_sequence:
+            return None
+        entry = self.__entries[sequence % self.__capacity]
+        return entry if entry.sequence == sequence else None
+
+    '''
+        Iterates over the entries from the given sequence number on, oldest first
+        Entries which have already been overwritten are skipped
+    '''
+    def since(self, sequence):
+        sequence = max(sequence, self.first_sequence())
+        end = self.__next_sequence
+        while sequence < end:
+            entry = self.__entries[sequence % self.__capacity]
+            if entry.sequence == sequence:
+                yield entry
+            sequence += 1
+
+    '''
+        Returns the given number of newest entries, newest first
+        Entries overwritten while reading are skipped, so readers never need a lock
+    '''
+    def latest(self, count):
+        end = self.__next_sequence
+        start = max(end - count, self.first_sequence())
+        entries = []
+        for sequence in range(end - 1, start - 1, -1):
+            entry = self.__entries[sequence % self.__capacity]
+            if entry.sequence == sequence:
+                entries.append(entry)
+        return entries
@@ -0,0 +1,278 @@
+from abc import ABC, abstractmethod
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+'''
+    Metrics of a system: counters, gauges and histograms, exported in the Prometheus text format
+
+    Metrics are updated and sampled without locks: a sample read while a writer updates a metric
+    may be off by the concurrent update, which is fine for monitoring.
+    Counters and gauges can be backed by a function instead of being updated, e.g. to read a count
+    the system keeps anyway, so they cost nothing until they are sampled.
+'''
+
+'''
+    A metric, with a value per combination of its label values
+'''
+class Metric(ABC):
+    TYPE = 'untyped'
+
+    def __init__(self, name, help, label_names=(), function=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.function = function
+        self.__children = {}
+
+    '''
+        Returns the value of the metric for the given label values, created on first use
+    '''
+    def labels(self, *label_values):
+        child = self.__children.get(label_values)
+        if child is None:
+            child = self.__children.setdefault(label_values, self.new_child())
+        return child
+
+    '''
+        Abstract method creating the value of the metric for a combination of label values
+    '''
+    @abstractmethod
+    def new_child(self):
+        pass
+
+    '''
+        Returns the samples of the metric: (name suffix, label values, extra labels, value) tuples
+    '''
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [('', label_values, {}, value) for label_values, value in values.items()]
+        samples = []
+        for label_values, child in list(self.__children.items()):
+            samples.extend((suffix, label_values, extra, value) for suffix, extra, value in child.samples())
+        return samples
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [('', {}, self.value)]
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        return [('', {}, self.value)]
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    '''
+        Records a value, in O(log buckets)
+    '''
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(('_bucket', {'le': format_value(bound)}, cumulative))
+        samples.append(('_bucket', {'le': '+Inf'}, cumulative + self.counts[-1]))
+        samples.append(('_sum', {}, self.sum))
+        samples.append(('_count', {}, self.count))
+        return samples
+
+'''
+    Monotonically increasing count
+'''
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+'''
+    Value which can go up and down
+'''
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+'''
+    Distribution of values, counted in fixed buckets
+'''
+class Histogram(Metric):
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+'''
+    Registry of the metrics of a system
+    When it is disabled, the system does not install its hot path instrumentation at all,
+    only the metrics backed by functions are exported
+'''
+class MetricsRegistry:
+    '''
+        Exception which can be raised when a metric is registered twice
+    '''
+    class DuplicateMetric(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.__metrics = {}
+
+    def __iter__(self):
+        return iter(list(self.__metrics.values()))
+
+    '''
+        Returns the metric with the given name, None if there is no such metric
+    '''
+    def get(self, name):
+        return self.__metrics.get(name)
+
+    '''
+        Registers a metric and returns it
+    '''
+    def register(self, metric):
+        if metric.name in self.__metrics:
+            raise self.DuplicateMetric(f'A metric named {metric.name} is already registered')
+        self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, label_names=(), function=None):
+        return self.register(Counter(name, help, label_names, function))
+
+    def gauge(self, name, help, label_names=(), function=None):
+        return self.register(Gauge(name, help, label_names, function))
+
+    def histogram(self, name, help, label_names=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    '''
+        Returns every metric in the Prometheus text exposition format
+    '''
+    def to_prometheus(self):
+        lines = []
+        for metric in self:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            for suffix, label_values, extra, value in metric.samples():
+                labels = dict(zip(metric.label_names, label_values))
+                labels.update(extra)
+                lines.append(f'{metric.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+'''
+    Formats labels as {name="value",...}, nothing if there are no labels
+'''
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+'''
+    Formats a sample value
+'''
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+'''
+    Wraps a process (a generator) so the wall-clock time of every step is passed to observe
+'''
+def timed(process, observe):
+    while True:
+        start = time.perf_counter()
+        try:
+            value = next(process)
+        except StopIteration as stop:
+            observe(time.perf_counter() - start)
+            return stop.value
+        observe(time.perf_counter() - start)
+        yield value
+
+'''
+    HTTP server exposing the metrics of a registry at /metrics, for Prometheus to pull, on a daemon thread
+'''
+class MetricsServer:
+    def __init__(self, registry, host='127.0.0.1', port=9100):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    '''
+        Returns the port the server listens on
+    '''
+    def get_port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,152 @@
+import threading
+
+from smarthome.automation_system import *
+
+'''
+    Coalesced, batched delivery of the state changes of a system
+
+    Consumers which only need the latest state of the devices (e.g. a view) do not have to react
+    to every step of every ramp. The notifier collects the state changes and keeps only the latest one
+    of every attribute of every device; the changes are delivered as a batch once the window opened by the first
+    pending change is over. A consumer is therefore called at most once per window, with at most one change
+    per device and attribute, whatever the rate of the events.
+    While the simulation runs, the window is in simulated seconds, timed by the scheduler; otherwise it is
+    in wall-clock seconds, timed by a timer thread (e.g. for the devices added in bulk while nothing runs).
+    The pending changes are delivered when the simulation starts and when it stops.
+'''
+
+'''
+    Changes delivered together: the latest change of every attribute of every device, in the order
+    they first changed, and the number of state changes they coalesce
+'''
+class Batch:
+    def __init__(self, time, changes, count):
+        self.time = time
+        self.changes = changes
+        self.count = count
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    '''
+        Returns the ids of the devices which changed
+    '''
+    def device_ids(self):
+        return {change.device.get_id() for change in self.changes}
+
+    '''
+        Returns true if a device was added or removed
+    '''
+    def structure_changed(self):
+        return any(change.event_type in (EventType.DEVICE_ADDED, EventType.DEVICE_REMOVED) for change in self.changes)
+
+'''
+    Notifier delivering the coalesced state changes of a system to its consumers
+'''
+class CoalescingNotifier:
+    DEFAULT_WINDOW = 0.1
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.__system = None
+        self.__consumers = []
+        self.__pending = {}
+        self.__count = 0
+        self.__timer = None
+        self.__running = False
+
+    '''
+        Starts collecting the state changes of a system
+        Returns the notifier
+    '''
+    def attach(self, system):
+        with system.lock:
+            self.__system = system
+            self.__running = system.sim_is_running
+            for event_type in EventType:
+                system.events.subscribe(event_type, self.__on_state_change)
+            system.add_simulation_hooks(self.__on_simulation_start, self.__on_simulation_stop)
+        return self
+
+    '''
+        Delivers the pending changes and stops collecting the state changes of the attached system
+    '''
+    def detach(self):
+        system = self.__system
+        if system is None:
+            return
+        with system.lock:
+            self.flush()
+            for event_type in EventType:
+                system.events.unsubscribe(event_type, self.__on_state_change)
+            system.remove_simulation_hooks(self.__on_simulation_start, self.__on_simulation_stop)
+            self.__running = False
+        self.__system = None
+
+    '''
+        Registers a consumer, it is called with every Batch
+    '''
+    def subscribe(self, consumer):
+        self.__consumers.append(consumer)
+
+    '''
+        Removes a previously registered consumer
+    '''
+    def unsubscribe(self, consumer):
+        if consumer in self.__consumers:
+            self.__consumers.remove(consumer)
+
+    '''
+        Delivers the changes pending from before the simulation, the window is then timed by the scheduler
+    '''
+    def __on_simulation_start(self, system):
+        self.flush()
+        self.__running = True
+
+    def __on_simulation_stop(self, system):
+        self.__running = False
+        self.flush()
+
+    def __on_state_change(self, event):
+        self.__pending[(event.device.get_id(), event.event_type)] = event
+        self.__count += 1
+        if self.__timer is None:
+            self.__open_window()
+
+    '''
+        Times the window opened by the first pending change
+    '''
+    def __open_window(self):
+        if self.window <= 0:
+            self.flush()
+        elif self.__running:
+            self.__timer = self.__system.scheduler.schedule(self.window, self.flush)
+        else:
+            self.__timer = threading.Timer(self.window, self.__flush_locked)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def __flush_locked(self):
+        system = self.__system
+        if system is not None:
+            with system.lock:
+                self.flush()
+
+    '''
+        Delivers the pending changes to the consumers at once, as a single batch
+        Has to be called holding the lock of the system
+    '''
+    def flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if not self.__pending:
+            return
+        batch = Batch(self.__system.clock.now(), list(self.__pending.values()), self.__count)
+        self.__pending = {}
+        self.__count = 0
+        for consumer in tuple(self.__consumers):
+            consumer(batch)
@@ -0,0 +1,86 @@
+import math
+
+from smarthome.scheduler import *
+
+'''
+    Analytic ramp of a value towards a target, one unit per step, like the brightness of a light
+    or the temperature of a thermostat
+
+    Instead of being stepped, the ramp is stored as its start value, its target, the time of its first step
+    and the time between steps; its current value is computed from the clock when it is read.
+    The only event scheduled is its completion, so a ramp costs a single event whatever its length.
+    It ends when it completes or when it is interrupted, which calls on_end with the final value
+    and fires its signal, so a process waiting for it is resumed. The process is resumed when a stepped
+    ramp would have noticed the interruption, at its next step, so both kinds of ramps simulate the same run.
+'''
+class Ramp:
+    EPSILON = 1e-9
+
+    def __init__(self, system, device, start_value, target, first_step, step_up_time, step_down_time, on_end,
+                 signal=None):
+        self.system = system
+        self.device = device
+        self.start_value = start_value
+        self.target = target
+        self.first_step = first_step
+        self.step_time = step_up_time if target > start_value else step_down_time
+        self.__step_up_time = step_up_time
+        self.__step_down_time = step_down_time
+        self.__on_end = on_end
+        self.signal = signal if signal else Signal()
+        self.__timer = system.scheduler.schedule_at(self.end_time(), self.__complete)
+        system.set_ramping(device, True)
+
+    '''
+        Returns the value of the ramp at the given time
+        Like a stepped ramp, the first step is taken at the time of the first step
+    '''
+    def value_at(self, when):
+        if when < self.first_step:
+            return self.start_value
+        distance = abs(self.target - self.start_value)
+        steps = min(distance, math.floor((when - self.first_step) / self.step_time + self.EPSILON) + 1)
+        return self.start_value + steps if self.target > self.start_value else self.start_value - steps
+
+    '''
+        Returns the current value of the ramp
+    '''
+    def value(self):
+        return self.value_at(self.system.clock.now())
+
+    '''
+        Returns the time the ramp completes at: one step time after its last step
+    '''
+    def end_time(self):
+        return self.first_step + abs(self.target - self.start_value) * self.step_time
+
+    '''
+        Returns the time of the first step after the given time
+    '''
+    def next_step(self, when):
+        steps = max(0, math.floor((when - self.first_step) / self.step_time + self.EPSILON) + 1)
+        return self.first_step + steps * self.step_time
+
+    '''
+        Stops the ramp at its current value
+    '''
+    def interrupt(self):
+        self.__timer.cancel()
+        now = self.system.clock.now()
+        self.system.set_ramping(self.device, False)
+        self.__on_end(self, self.value_at(now))
+        self.system.scheduler.schedule_at(self.next_step(now), self.signal.fire)
+
+    '''
+        Continues the ramp from a new value, from its next step on
+        Returns the new ramp, the process waiting for this one waits for the new one instead
+    '''
+    def rebase(self, value):
+        self.__timer.cancel()
+        return Ramp(self.system, self.device, value, self.target, self.next_step(self.system.clock.now()),
+                    self.__step_up_time, self.__step_down_time, self.__on_end, self.signal)
+
+    def __complete(self):
+        self.system.set_ramping(self.device, False)
+        self.__on_end(self, self.target)
+        self.signal.fire()
@@ -0,0 +1,113 @@
+from smarthome.devices import *
+from smarthome.events import *
+
+'''
+    Registry of the devices of a system, indexed by id, by device type and by power status
+    Adding, removing and looking up a device, and counting devices by status are O(1)
+'''
+class DeviceRegistry:
+    '''
+        Exception which can be raised when a device with the same id is already registered
+    '''
+    class DuplicateDevice(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    def __init__(self, capacity=None):
+        self.__capacity = capacity
+        self.__by_id = {}
+        self.__by_type = {}
+        self.__by_status = {status: {} for status in Status}
+
+    '''
+        Returns the maximum number of devices, None if unlimited
+    '''
+    def get_capacity(self):
+        return self.__capacity
+
+    '''
+        Returns true if no more devices can be added
+    '''
+    def is_full(self):
+        return self.__capacity is not None and len(self.__by_id) >= self.__capacity
+
+    def __len__(self):
+        return len(self.__by_id)
+
+    def __iter__(self):
+        return iter(list(self.__by_id.values()))
+
+    def __contains__(self, device):
+        return self.__by_id.get(device.get_id()) is device
+
+    '''
+        Registers a device
+    '''
+    def add(self, device):
+        device_id = device.get_id()
+        if device_id in self.__by_id:
+            raise self.DuplicateDevice(f'A device with id {device_id} is already registered')
+        self.__by_id[device_id] = device
+        self.__by_type.setdefault(type(device), {})[device_id] = device
+        self.__by_status[device.get_status()][device_id] = device
+
+    '''
+        Unregisters a device
+    '''
+    def remove(self, device):
+        device_id = device.get_id()
+        if self.__by_id.get(device_id) is not device:
+            raise ValueError(f'{device.get_name()} is not registered')
+        del self.__by_id[device_id]
+        del self.__by_type[type(device)][device_id]
+        for devices in self.__by_status.values():
+            devices.pop(device_id, None)
+
+    '''
+        Returns the device with the given id, None if there is no such device
+    '''
+    def get(self, device_id):
+        return self.__by_id.get(device_id)
+
+    '''
+        Returns the devices which are instances of the given type
+    '''
+    def of_type(self, device_type):
+        devices = []
+        for registered_type, by_id in self.__by_type.items():
+            if issubclass(registered_type, device_type):
+                devices.extend(by_id.values())
+        return devices
+
+    '''
+        Returns the devices with the given power status
+    '''
+    def with_status(self, status):
+        return list(self.__by_status[status].values())
+
+    '''
+        Returns the number of devices with the given power status, or every device if no status was given
+    '''
+    def count(self, status=None):
+        if status is None:
+            return len(self.__by_id)
+        return len(self.__by_status[status])
+
+    '''
+        Returns true if any of the devices is turned on
+    '''
+    def any_on(self):
+        return bool(self.__by_status[Status.ON])
+
+    '''
+        Keeps the status index up to date, subscribed to the power status changes of the system
+    '''
+    def on_status_changed(self, event):
+        device_id = event.device.get_id()
+        if self.__by_id.get(device_id) is not event.device:
+            return
+        for status, devices in self.__by_status.items():
+            if status == event.value:
+                devices[device_id] = event.device
+            else:
+                devices.pop(device_id, None)
@@ -0,0 +1,43 @@
+import random
+
+'''
+    Independent, seeded stream of random numbers
+
+    In batch mode the values of a range are pre-generated in bulk, in a single call,
+    so drawing a value is only a list lookup. The values only depend on the seed,
+    so runs are reproducible whatever the order the streams are used in.
+'''
+class RandomStream:
+    def __init__(self, seed, batch_size=None):
+        self.__random = random.Random(seed)
+        self.__batch_size = batch_size
+        self.__batches = {}
+
+    '''
+        Returns a random integer N such that a <= N <= b
+    '''
+    def randint(self, a, b):
+        if not self.__batch_size:
+            return self.__random.randint(a, b)
+        batch = self.__batches.get((a, b))
+        if not batch:
+            batch = self.__random.choices(range(a, b + 1), k=self.__batch_size)
+            batch.reverse()
+            self.__batches[(a, b)] = batch
+        return batch.pop()
+
+'''
+    Factory of the random streams of a system
+    Every stream is derived from the seed of the system and its own key (e.g. a device id),
+    so the streams are independent of each other and of the order they are created in
+'''
+class RandomStreams:
+    def __init__(self, seed=None, batch_size=None):
+        self.seed = seed if seed is not None else random.randrange(2 ** 63)
+        self.batch_size = batch_size
+
+    '''
+        Returns a new stream for the given key
+    '''
+    def stream(self, key):
+        return RandomStream(f'{self.seed}:{key}', self.batch_size)
@@ -0,0 +1,442 @@
+from datetime import datetime, timedelta
+import json
+import operator
+
+from smarthome.automation_system import *
+
+'''
+    Declarative automation rules, loaded from a file
+
+    A rule has the form "when <predicates on a device's attributes> then <actions>", for example:
+
+        {"name": "Lights off on alert",
+         "when": {"type": "SecurityCamera", "attribute": "security_status", "op": "==", "value": "ALERT"},
+         "then": [{"action": "turn_off", "target": {"type": "SmartLight"}}]}
+
+    "when" is a predicate or {"all": [predicates]}, every predicate is about the same device,
+    which can be restricted to a type and an id. A rule fires when its condition becomes true for a device.
+    With "idle": N, it fires instead once its condition has held for N seconds without any of its attributes changing
+    (e.g. a light which stays on, at the same brightness, for 10 minutes).
+    Scheduled rules have no condition, but "at": "HH:MM[:SS]" (every day, in clock time) or "every": N seconds.
+    Their timers are events on the scheduler of the system, so they need no thread and are cancelled in O(1).
+    Actions: turn_on, turn_off, set_brightness, set_temperature (with a value) and log (with a message);
+    their target is the device itself ("self", the default), {"type": ...}, {"id": ...}, or "none".
+    The logs of the actions of a rule are written as a burst, so turning off 25 lights logs "25 lights turned OFF".
+'''
+
+'''
+    Attributes which can be used in predicates, with the event type which changes them
+'''
+ATTRIBUTE_EVENTS = {
+    'status': EventType.STATUS_CHANGED,
+    'brightness': EventType.BRIGHTNESS_CHANGED,
+    'temperature': EventType.TEMPERATURE_CHANGED,
+    'desired_temp': EventType.DESIRED_TEMP_CHANGED,
+    'security_status': EventType.SECURITY_STATUS_CHANGED,
+}
+
+EVENT_ATTRIBUTES = {event_type: attribute for attribute, event_type in ATTRIBUTE_EVENTS.items()}
+
+ATTRIBUTE_GETTERS = {
+    'status': lambda device: device.get_status(),
+    'brightness': lambda device: device.get_brightness(),
+    'temperature': lambda device: device.get_temperature(),
+    'desired_temp': lambda device: device.get_desired_temp(),
+    'security_status': lambda device: device.get_security_status(),
+}
+
+ATTRIBUTE_ENUMS = {
+    'status': Status,
+    'security_status': SecurityStatus,
+}
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+'''
+    Operators which can compare the attributes holding an enumeration value
+'''
+EQUALITY_OPERATORS = ('==', '!=')
+
+RULE_DEVICE_TYPES = {
+    'Device': Device,
+    'SmartLight': SmartLight,
+    'Thermostat': Thermostat,
+    'SecurityCamera': SecurityCamera,
+}
+
+'''
+    A compiled predicate: compares one attribute of a device to a constant
+'''
+class Predicate:
+    def __init__(self, attribute, op, value):
+        self.attribute = attribute
+        self.op = op
+        self.value = value
+        self.getter = ATTRIBUTE_GETTERS[attribute]
+
+    '''
+        Evaluates the predicate, using the new value of the attribute if it is the one that changed
+        Devices which do not have the attribute never satisfy it
+    '''
+    def evaluate(self, device, attribute, value):
+        if attribute != self.attribute:
+            try:
+                value = self.getter(device)
+            except AttributeError:
+                return False
+        return value is not None and self.op(value, self.value)
+
+'''
+    A compiled rule: the device type and id it applies to, its predicates and its actions
+    Rules with an idle time fire when their condition held for that many seconds
+'''
+class CompiledRule:
+    def __init__(self, number, name, device_type, device_id, predicates, actions, idle=None):
+        self.number = number
+        self.name = name
+        self.device_type = device_type
+        self.device_id = device_id
+        self.predicates = predicates
+        self.actions = actions
+        self.idle = idle
+
+    '''
+        Returns true if every predicate holds for the device
+    '''
+    def matches(self, device, attribute, value):
+        if self.device_id is not None and device.get_id() != self.device_id:
+            return False
+        for predicate in self.predicates:
+            if not predicate.evaluate(device, attribute, value):
+                return False
+        return True
+
+    '''
+        Runs the actions of the rule
+    '''
+    def fire(self, system, device):
+        with system.log_burst():
+            for action in self.actions:
+                action(system, device)
+
+'''
+    A compiled scheduled rule: runs its actions every day at the given time of day, or at a fixed interval
+'''
+class ScheduledRule:
+    def __init__(self, number, name, actions, at=None, every=None):
+        self.number = number
+        self.name = name
+        self.actions = actions
+        self.at = at
+        self.every = every
+
+    '''
+        Returns the next time the rule is due after the given time, in clock time
+    '''
+    def next_time(self, now):
+        if self.every is not None:
+            return now + self.every
+        when = datetime.fromtimestamp(now).replace(hour=self.at.hour, minute=self.at.minute, second=self.at.second,
+                                                   microsecond=0)
+        if when.timestamp() <= now:
+            when += timedelta(days=1)
+        return when.timestamp()
+
+    '''
+        Runs the actions of the rule, which have no triggering device
+    '''
+    def fire(self, system):
+        with system.log_burst():
+            for action in self.actions:
+                action(system, None)
+
+'''
+    A set of declarative rules, run as a single automation
+
+    The conditions are compiled into an index keyed by device type and attribute, so a state change
+    only evaluates the rules which reference the attribute that changed, for that type of device.
+    The rule set only subscribes to the events its rules reference.
+    Idle and scheduled rules keep one timer per device and rule on the scheduler, which is moved on every change.
+'''
+class RuleSet(AutomationRule):
+    '''
+        Exception which can be raised when a rule description is invalid
+    '''
+    class InvalidRule(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    def __init__(self, rules, description=None):
+        super().__init__(description if description else f'{len(rules)} declarative rules')
+        self.rules = rules
+        self.scheduled_rules = [rule for rule in rules if isinstance(rule, ScheduledRule)]
+        self.__index = {}
+        for rule in rules:
+            if isinstance(rule, ScheduledRule):
+                continue
+            for attribute in {predicate.attribute for predicate in rule.predicates}:
+                self.__index.setdefault((rule.device_type, attribute), []).append(rule)
+        self.__dispatch = {}
+        self.__matching = set()
+        self.__idle_timers = {}
+        self.__scheduled_timers = {}
+        self.__system = None
+
+    '''
+        Returns the rules which reference the attribute for the given class of device
+        Computed once per class and attribute, then looked up in O(1)
+    '''
+    def rules_for(self, device_class, attribute):
+        key = (device_class, attribute)
+        rules = self.__dispatch.get(key)
+        if rules is None:
+            rules = [rule for (device_type, indexed_attribute), indexed in self.__index.items()
+                     if indexed_attribute == attribute and issubclass(device_class, device_type)
+                     for rule in indexed]
+            rules.sort(key=lambda rule: rule.number)
+            self.__dispatch[key] = rules
+        return rules
+
+    '''
+        Evaluates the rules referencing the changed attribute, and fires those whose condition became true
+    '''
+    def __on_state_change(self, event):
+        attribute = EVENT_ATTRIBUTES[event.event_type]
+        device = event.device
+        for rule in self.rules_for(type(device), attribute):
+            key = (rule.number, device.get_id())
+            if rule.idle is not None:
+                self.__restart_idle_timer(key, rule, device, rule.matches(device, attribute, event.value))
+                continue
+            if rule.matches(device, attribute, event.value):
+                if key not in self.__matching:
+                    self.__matching.add(key)
+                    rule.fire(self.__system, device)
+            else:
+                self.__matching.discard(key)
+
+    '''
+        Cancels the idle timer of a rule for a device, and starts it again if the condition holds
+    '''
+    def __restart_idle_timer(self, key, rule, device, matches):
+        timer = self.__idle_timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        if matches:
+            self.__idle_timers[key] = self.__system.scheduler.schedule(rule.idle, self.__on_idle, key, rule, device)
+
+    def __on_idle(self, key, rule, device):
+        del self.__idle_timers[key]
+        rule.fire(self.__system, device)
+
+    '''
+        Schedules the next run of a scheduled rule
+    '''
+    def __schedule_next(self, rule):
+        scheduler = self.__system.scheduler
+        self.__scheduled_timers[rule.number] = scheduler.schedule_at(rule.next_time(scheduler.now()),
+                                                                     self.__on_schedule, rule)
+
+    def __on_schedule(self, rule):
+        self.__schedule_next(rule)
+        rule.fire(self.__system)
+
+    def __on_device_removed(self, event):
+        device_id = event.device.get_id()
+        self.__matching = {key for key in self.__matching if key[1] != device_id}
+        for key in [key for key in self.__idle_timers if key[1] == device_id]:
+            self.__idle_timers.pop(key).cancel()
+
+    '''
+        Subscribes to the events which change the attributes referenced by the rules,
+        starts the idle timers of the devices which already satisfy their rule and schedules the scheduled rules
+    '''
+    def start(self, system):
+        self.__system = system
+        self.__matching = set()
+        for attribute in {attribute for _, attribute in self.__index}:
+            system.events.subscribe(ATTRIBUTE_EVENTS[attribute], self.__on_state_change)
+        system.events.subscribe(EventType.DEVICE_REMOVED, self.__on_device_removed)
+        for rule in self.rules:
+            if isinstance(rule, CompiledRule) and rule.idle is not None:
+                for device in system.get_devices_of_type(rule.device_type):
+                    key = (rule.number, device.get_id())
+                    self.__restart_idle_timer(key, rule, device, rule.matches(device, None, None))
+        for rule in self.scheduled_rules:
+            self.__schedule_next(rule)
+
+    '''
+        Unsubscribes from the events and cancels every timer
+    '''
+    def stop(self, system):
+        for attribute in {attribute for _, attribute in self.__index}:
+            system.events.unsubscribe(ATTRIBUTE_EVENTS[attribute], self.__on_state_change)
+        system.events.unsubscribe(EventType.DEVICE_REMOVED, self.__on_device_removed)
+        for timer in [*self.__idle_timers.values(), *self.__scheduled_timers.values()]:
+            timer.cancel()
+        self.__idle_timers.clear()
+        self.__scheduled_timers.clear()
+        self.__system = None
+
+'''
+    Returns the device type with the given name
+'''
+def parse_device_type(name):
+    if name not in RULE_DEVICE_TYPES:
+        raise RuleSet.InvalidRule(f'Unknown device type: {name}')
+    return RULE_DEVICE_TYPES[name]
+
+'''
+    Compiles a predicate description
+'''
+def compile_predicate(data):
+    attribute = data.get('attribute')
+    if attribute not in ATTRIBUTE_GETTERS:
+        raise RuleSet.InvalidRule(f'Unknown attribute: {attribute}')
+    op = data.get('op', '==')
+    if op not in OPERATORS:
+        raise RuleSet.InvalidRule(f'Unknown operator: {op}')
+    value = data.get('value')
+    if attribute in ATTRIBUTE_ENUMS:
+        if op not in EQUALITY_OPERATORS:
+            raise RuleSet.InvalidRule(f'{attribute} can only be compared with {" or ".join(EQUALITY_OPERATORS)}: {op}')
+        try:
+            value = ATTRIBUTE_ENUMS[attribute][value]
+        except (KeyError, TypeError):
+            raise RuleSet.InvalidRule(f'Invalid value for {attribute}: {value}')
+    elif not isinstance(value, int) or isinstance(value, bool):
+        raise RuleSet.InvalidRule(f'The value of {attribute} must be an integer: {value!r}')
+    return Predicate(attribute, OPERATORS[op], value)
+
+'''
+    Compiles the target of an action into a function returning the devices to act on
+'''
+def compile_target(target):
+    if target in (None, 'self'):
+        return lambda system, device: [device] if device else []
+    if target == 'none':
+        return lambda system, device: []
+    if 'id' in target:
+        device_id = target['id']
+        return lambda system, device: [found] if (found := system.get_device(device_id)) else []
+    if 'type' in target:
+        device_type = parse_device_type(target['type'])
+        return lambda system, device: system.get_devices_of_type(device_type)
+    raise RuleSet.InvalidRule(f'Invalid target: {target}')
+
+'''
+    Returns the value of an action, which has to be an integer in [low, high]
+'''
+def compile_value(data, low, high):
+    value = data.get('value')
+    if not isinstance(value, int) or isinstance(value, bool) or value < low or value > high:
+        raise RuleSet.InvalidRule(f'The value of {data.get("action")} must be an integer between {low} and {high}: {value!r}')
+    return value
+
+'''
+    Compiles an action description into a function of the system and the triggering device
+'''
+def compile_action(data):
+    name = data.get('action')
+    targets = compile_target(data.get('target'))
+    if name == 'turn_on':
+        def action(system, device):
+            for target in targets(system, device):
+                target.turn_on(system)
+    elif name == 'turn_off':
+        def action(system, device):
+            for target in targets(system, device):
+                target.turn_off(system)
+    elif name == 'set_brightness':
+        value = compile_value(data, SmartLight.MIN_BRIGHTNESS, SmartLight.MAX_BRIGHTNESS)
+        def action(system, device):
+            for target in targets(system, device):
+                if isinstance(target, SmartLight):
+                    target.set_brightness(system, value)
+    elif name == 'set_temperature':
+        value = compile_value(data, Thermostat.MIN_TEMP, Thermostat.MAX_TEMP)
+        def action(system, device):
+            for target in targets(system, device):
+                if isinstance(target, Thermostat):
+                    target.set_temperature(system, value)
+    elif name == 'log':
+        message = data.get('message', '')
+        def action(system, device):
+            system.add_log(message.format(device=device.get_name() if device else ''), device)
+    else:
+        raise RuleSet.InvalidRule(f'Unknown action: {name}')
+    return action
+
+'''
+    Parses a time of day in HH:MM or HH:MM:SS format
+'''
+def parse_time_of_day(text):
+    for time_format in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(text, time_format).time()
+        except ValueError:
+            pass
+    raise RuleSet.InvalidRule(f'Invalid time of day: {text}')
+
+'''
+    Compiles a scheduled rule description
+'''
+def compile_scheduled_rule(number, data):
+    then = data.get('then')
+    if not then:
+        raise RuleSet.InvalidRule(f'Rule #{number} needs a "then"')
+    if 'at' in data and 'every' in data:
+        raise RuleSet.InvalidRule(f'Rule #{number} can only have one of "at" and "every"')
+    every = data.get('every')
+    if every is not None and every <= 0:
+        raise RuleSet.InvalidRule(f'The interval of rule #{number} must be positive')
+    at = parse_time_of_day(data['at']) if 'at' in data else None
+    actions = [compile_action(action) for action in (then if isinstance(then, list) else [then])]
+    return ScheduledRule(number, data.get('name', f'Rule #{number}'), actions, at, every)
+
+'''
+    Compiles a rule description
+'''
+def compile_rule(number, data):
+    if 'at' in data or 'every' in data:
+        return compile_scheduled_rule(number, data)
+    when = data.get('when')
+    then = data.get('then')
+    idle = data.get('idle')
+    if idle is not None and idle <= 0:
+        raise RuleSet.InvalidRule(f'The idle time of rule #{number} must be positive')
+    if not when or not then:
+        raise RuleSet.InvalidRule(f'Rule #{number} needs a "when" and a "then"')
+    predicates_data = when['all'] if 'all' in when else [when]
+    device_types = {predicate.get('type', 'Device') for predicate in predicates_data}
+    device_ids = {predicate['id'] for predicate in predicates_data if 'id' in predicate}
+    if len(device_types) > 1 or len(device_ids) > 1:
+        raise RuleSet.InvalidRule(f'Every predicate of rule #{number} must be about the same device')
+    actions = [compile_action(action) for action in (then if isinstance(then, list) else [then])]
+    return CompiledRule(number, data.get('name', f'Rule #{number}'), parse_device_type(device_types.pop()),
+                        device_ids.pop() if device_ids else None,
+                        [compile_predicate(predicate) for predicate in predicates_data], actions, idle)
+
+'''
+    Compiles a rule set description: a dict with a list of rules
+'''
+def compile_rules(data, description=None):
+    try:
+        return RuleSet([compile_rule(number, rule) for number, rule in enumerate(data.get('rules', []))],
+                       description)
+    except (AttributeError, KeyError, TypeError) as ex:
+        raise RuleSet.InvalidRule(f'Invalid rules: {ex!r}')
+
+'''
+    Loads a rule set from a JSON file
+'''
+def load_rules(path):
+    with open(path) as file:
+        return compile_rules(json.load(file))
@@ -0,0 +1,137 @@
+import argparse
+import json
+import time
+
+from smarthome.scenario import *
+
+'''
+    Headless batch runner for simulation scenarios
+
+    Usage: python -m smarthome.run scenario.json [--duration SECONDS] [--seed SEED] [--speed SPEED|max] [--output FILE]
+                                                 [--metrics FILE]
+'''
+
+'''
+    Measures how long (in wall-clock time) the automations take to turn off a light after a camera alert
+'''
+class RuleLatencyProbe:
+    def __init__(self, system):
+        self.latencies = []
+        self.__alert_time = None
+        system.events.subscribe(EventType.SECURITY_STATUS_CHANGED, self.__on_security_status_changed)
+        system.events.subscribe(EventType.STATUS_CHANGED, self.__on_status_changed)
+
+    def __on_security_status_changed(self, event):
+        if event.value == SecurityStatus.ALERT:
+            if self.__alert_time is None:
+                self.__alert_time = time.perf_counter()
+        else:
+            self.__alert_time = None
+
+    def __on_status_changed(self, event):
+        if self.__alert_time is not None and event.value == Status.OFF and isinstance(event.device, SmartLight):
+            self.latencies.append(time.perf_counter() - self.__alert_time)
+            self.__alert_time = None
+
+'''
+    Returns the given percentile of a list of values, None if it is empty
+'''
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+'''
+    Returns the number of devices turned on and off, by device type
+'''
+def final_state(system):
+    by_type = {}
+    for name, device_type in DEVICE_TYPES.items():
+        devices = system.get_devices_of_type(device_type)
+        on = sum(1 for device in devices if device.get_status() == Status.ON)
+        by_type[name] = {'on': on, 'off': len(devices) - on}
+    return {
+        'devices_on': system.count_devices(Status.ON),
+        'by_type': by_type,
+    }
+
+'''
+    Runs a scenario to its horizon and returns its summary metrics
+    If a metrics path is given, the metrics of the system are enabled and written there in the Prometheus text format
+'''
+def run_scenario(scenario, metrics_path=None):
+    system = scenario.build(metrics=metrics_path is not None)
+    probe = RuleLatencyProbe(system)
+    start_time = system.clock.now()
+    wall_start = time.perf_counter()
+    system.start_simulation(scenario.duration)
+    wall_seconds = time.perf_counter() - wall_start
+    if metrics_path:
+        with open(metrics_path, 'w') as file:
+            file.write(system.metrics.to_prometheus())
+    latencies_us = [latency * 1e6 for latency in probe.latencies]
+    return {
+        'scenario': scenario.name,
+        'seed': scenario.seed,
+        'devices': system.count_devices(),
+        'simulated_seconds': system.clock.now() - start_time,
+        'wall_seconds': wall_seconds,
+        'events': system.scheduler.event_count,
+        'events_per_second': system.scheduler.event_count / wall_seconds if wall_seconds > 0 else None,
+        'log_entries': system.log_store.next_sequence(),
+        'rule_latency_us': {
+            'count': len(latencies_us),
+            'p50': percentile(latencies_us, 50),
+            'p90': percentile(latencies_us, 90),
+            'p99': percentile(latencies_us, 99),
+            'max': max(latencies_us) if latencies_us else None,
+        },
+        'final_state': final_state(system),
+    }
+
+'''
+    Parses a clock speed: a positive number, or "max" for maximum speed
+'''
+def parse_speed(value):
+    if value == 'max':
+        return Clock.MAX_SPEED
+    speed = float(value)
+    if not speed > 0:
+        raise argparse.ArgumentTypeError(f'speed must be positive, or "max": {value}')
+    return speed
+
+'''
+    Command line entry point
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smarthome.run', description='Runs a smart home scenario without a GUI.')
+    parser.add_argument('scenario', help='path of the JSON scenario file')
+    parser.add_argument('--duration', type=float, help='simulated seconds to run, overrides the scenario')
+    parser.add_argument('--seed', type=int, help='random seed, overrides the scenario')
+    parser.add_argument('--speed', type=parse_speed, default=argparse.SUPPRESS,
+                        help='clock speed-up, or "max" for no sleeping at all')
+    parser.add_argument('--output', help='file to write the metrics to, instead of the standard output')
+    parser.add_argument('--metrics', help='file to write the detailed metrics to, in the Prometheus text format')
+    args = parser.parse_args(argv)
+
+    try:
+        scenario = load_scenario(args.scenario)
+    except (OSError, ValueError, Scenario.InvalidScenario) as ex:
+        parser.error(str(ex))
+    if args.duration is not None:
+        scenario.duration = args.duration
+    if args.seed is not None:
+        scenario.seed = args.seed
+    if 'speed' in args:
+        scenario.speed = args.speed
+
+    result = json.dumps(run_scenario(scenario, args.metrics), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(result + '\n')
+    else:
+        print(result)
+
+if __name__ == '__main__':
+    main()
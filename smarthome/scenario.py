@@ -0,0 +1,151 @@
+import csv
+import json
+import os
+
+from smarthome.automation_system import *
+from smarthome.rule_engine import *
+
+'''
+    Device types which can be used in scenarios, by name
+'''
+DEVICE_TYPES = {
+    'SmartLight': SmartLight,
+    'Thermostat': Thermostat,
+    'SecurityCamera': SecurityCamera,
+}
+
+'''
+    Description of a simulation run: the device mix, the seed, the simulated duration and the clock speed
+    Declarative rules (see rule_engine) can be added to the automations of the system
+    With a seed, a maximum speed clock and a start time, runs are reproducible
+
+    The devices are given by type, either as a count of devices which are turned on,
+    or as {"count": N, "status": "ON" or "OFF"}. They are provisioned in bulk, a block of ids per type.
+'''
+class Scenario:
+    '''
+        Exception which can be raised when a scenario description is invalid
+    '''
+    class InvalidScenario(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    DEFAULT_DURATION = 3600
+
+    def __init__(self, name='scenario', devices=None, seed=None, duration=DEFAULT_DURATION, speed=Clock.MAX_SPEED,
+                 max_devices=None, rng_batch_size=None, start_time=None, rules=None, time_skipping=False):
+        self.name = name
+        self.devices = devices if devices else {}
+        self.seed = seed
+        self.duration = duration
+        self.speed = speed
+        self.max_devices = max_devices
+        self.rng_batch_size = rng_batch_size
+        self.start_time = start_time
+        self.rules = rules
+        self.time_skipping = time_skipping
+        if not isinstance(self.devices, dict):
+            raise self.InvalidScenario(f'Devices must be a mapping of device types to device specs: {self.devices!r}')
+        for device_type, spec in self.devices.items():
+            if device_type not in DEVICE_TYPES:
+                raise self.InvalidScenario(f'Unknown device type: {device_type}')
+            count, status = parse_device_spec(spec)
+            if count < 0:
+                raise self.InvalidScenario(f'Device count must be non-negative: {device_type}')
+        if duration is not None and duration <= 0:
+            raise self.InvalidScenario('Duration must be positive.')
+        if speed is not None and (not isinstance(speed, (int, float)) or speed <= 0):
+            raise self.InvalidScenario('Speed must be positive, or null for maximum speed.')
+        if rules is not None:
+            try:
+                compile_rules(rules)
+            except RuleSet.InvalidRule as ex:
+                raise self.InvalidScenario(f'Invalid rules: {ex}')
+
+    '''
+        Returns the scenario as a dict, in the format it is stored in
+    '''
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'devices': dict(self.devices),
+            'seed': self.seed,
+            'duration': self.duration,
+            'speed': self.speed,
+            'max_devices': self.max_devices,
+            'rng_batch_size': self.rng_batch_size,
+            'start_time': self.start_time,
+            'rules': self.rules,
+            'time_skipping': self.time_skipping,
+        }
+
+    '''
+        Adds the devices of the scenario to a system, in a single bulk addition
+        Returns the new devices
+    '''
+    def provision(self, system):
+        devices = []
+        for device_type, spec in self.devices.items():
+            count, status = parse_device_spec(spec)
+            devices.extend(system.create_devices(DEVICE_TYPES[device_type], count, status))
+        return system.add_devices(devices)
+
+    '''
+        Creates the system of the scenario, with every device added, and with its metrics enabled if metrics is true
+    '''
+    def build(self, metrics=False):
+        system = AutomationSystem(Clock(self.speed, self.start_time), max_devices=self.max_devices, seed=self.seed,
+                                  rng_batch_size=self.rng_batch_size, metrics=metrics, time_skipping=self.time_skipping)
+        if self.rules is not None:
+            system.add_automation(compile_rules(self.rules))
+        self.provision(system)
+        return system
+
+'''
+    Returns the count and the power status of a device spec of a scenario
+'''
+def parse_device_spec(spec):
+    if isinstance(spec, int):
+        return spec, Status.ON
+    try:
+        return spec['count'], Status[spec.get('status', 'ON')]
+    except (KeyError, TypeError, AttributeError):
+        raise Scenario.InvalidScenario(f'Invalid device spec: {spec}')
+
+'''
+    Creates a scenario from a dict
+'''
+def scenario_from_dict(data):
+    try:
+        return Scenario(**data)
+    except TypeError as ex:
+        raise Scenario.InvalidScenario(f'Invalid scenario: {ex}')
+
+'''
+    Loads the devices of a scenario from a CSV file, with a type, a count and an optional status column:
+
+        type,count,status
+        SmartLight,40000,ON
+        Thermostat,10000,OFF
+'''
+def load_scenario_csv(path):
+    devices = {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            try:
+                count = int(row['count'])
+            except (KeyError, TypeError, ValueError):
+                raise Scenario.InvalidScenario(f'Invalid device count in row: {row}')
+            status = (row.get('status') or 'ON').strip().upper()
+            devices[row.get('type', '').strip()] = {'count': count, 'status': status}
+    name = os.path.splitext(os.path.basename(path))[0]
+    return scenario_from_dict({'name': name, 'devices': devices})
+
+'''
+    Loads a scenario from a JSON file, or only its devices from a CSV file
+'''
+def load_scenario(path):
+    if path.lower().endswith('.csv'):
+        return load_scenario_csv(path)
+    with open(path) as file:
+        return scenario_from_dict(json.load(file))
@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import itertools
+import threading
+
+from smarthome.clock import *
+
+'''
+    A callback scheduled on the event heap
+'''
+class Timer:
+    def __init__(self, when, callback, args, scheduler=None):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.scheduler = scheduler
+
+    '''
+        Cancels the timer, it is dropped when it reaches the top of the heap (or when the heap is compacted)
+    '''
+    def cancel(self):
+        if self.scheduler:
+            self.scheduler.cancel(self)
+        else:
+            self.cancelled = True
+
+'''
+    Something a process can wait for: a process which yields a signal is resumed when the signal fires
+'''
+class Signal:
+    def __init__(self):
+        self.__waiters = []
+        self.fired = False
+
+    '''
+        Registers a callback which is called when the signal fires (at once, if it has already fired)
+    '''
+    def add_waiter(self, callback, *args):
+        if self.fired:
+            callback(*args)
+        else:
+            self.__waiters.append((callback, args))
+
+    '''
+        Fires the signal, calling every waiter
+    '''
+    def fire(self):
+        if self.fired:
+            return
+        self.fired = True
+        waiters, self.__waiters = self.__waiters, []
+        for callback, args in waiters:
+            callback(*args)
+
+'''
+    Discrete-event scheduler: every timed step of the simulation is an event on a single heap.
+
+    Devices are simulated by processes: generators which yield the delay (in seconds)
+    until they want to be resumed, or a Signal to be resumed when it fires. Many processes can be in progress at the same time
+    without a thread or a blocking sleep for each of them.
+    Time is read from the clock, so the events can run in real time, faster, or without sleeping at all.
+    Every event is run holding the dispatch lock, so it is applied atomically with respect to other writers.
+    Cancelling a timer is O(1): it is only marked, and skipped when it is popped. When most of the heap is made of
+    cancelled timers, it is compacted in a single pass, so tens of thousands of timers which are rescheduled
+    over and over (e.g. idle timeouts) do not pile up.
+    The events can be run by a blocking loop (run) or by a coroutine on an asyncio event loop (run_async).
+'''
+class Scheduler:
+    ASYNC_YIELD_INTERVAL = 256
+    COMPACT_THRESHOLD = 1024
+
+    __STOP = object()
+
+    def __init__(self, clock=None, dispatch_lock=None):
+        self.clock = clock if clock else Clock()
+        self.__queue = []
+        self.__sequence = itertools.count()
+        self.__lock = threading.Lock()
+        self.__dispatch_lock = dispatch_lock if dispatch_lock else threading.RLock()
+        self.__wakeup = threading.Event()
+        self.__loop = None
+        self.__async_wakeup = None
+        self.__running = False
+        self.__cancelled = 0
+        self.event_count = 0
+
+    '''
+        Returns the current time of the scheduler in seconds
+    '''
+    def now(self):
+        return self.clock.now()
+
+    '''
+        Returns the number of pending events
+    '''
+    def pending(self):
+        return len(self.__queue) - self.__cancelled
+
+    '''
+        Schedules a callback to be called after the given delay
+        Returns the timer, which can be cancelled
+    '''
+    def schedule(self, delay, callback, *args):
+        return self.schedule_at(self.now() + delay, callback, *args)
+
+    '''
+        Schedules a callback to be called at the given time
+        Returns the timer, which can be cancelled
+    '''
+    def schedule_at(self, when, callback, *args):
+        timer = Timer(when, callback, args, self)
+        with self.__lock:
+            heapq.heappush(self.__queue, (when, next(self.__sequence), timer))
+        self.__wake()
+        return timer
+
+    '''
+        Cancels a timer
+        The heap is compacted once more than half of it is cancelled timers, which keeps cancelling O(1) amortized
+    '''
+    def cancel(self, timer):
+        with self.__lock:
+            if timer.cancelled:
+                return
+            timer.cancelled = True
+            if timer.scheduler is not self:
+                return
+            timer.scheduler = None
+            self.__cancelled += 1
+            if self.__cancelled > self.COMPACT_THRESHOLD and self.__cancelled * 2 > len(self.__queue):
+                self.__queue = [entry for entry in self.__queue if not entry[2].cancelled]
+                heapq.heapify(self.__queue)
+                self.__cancelled = 0
+
+    '''
+        Starts a process after the given delay
+    '''
+    def spawn(self, process, delay=0):
+        return self.schedule(delay, self.__step, process)
+
+    '''
+        Resumes a process until its next yield, then schedules its next step
+    '''
+    def __step(self, process):
+        try:
+            delay = next(process)
+        except StopIteration:
+            return
+        if isinstance(delay, Signal):
+            delay.add_waiter(self.spawn, process)
+        else:
+            self.schedule(delay, self.__step, process)
+
+    '''
+        Removes every pending event
+    '''
+    def clear(self):
+        with self.__lock:
+            for _, _, timer in self.__queue:
+                timer.scheduler = None
+            self.__queue.clear()
+            self.__cancelled = 0
+
+    '''
+        Pops the next due event, or returns the time of the next event (None if the heap is empty)
+        Events after the given horizon are never due
+    '''
+    def __next_due(self, until=None):
+        with self.__lock:
+            while self.__queue:
+                when, _, timer = self.__queue[0]
+                if timer.cancelled:
+                    heapq.heappop(self.__queue)
+                    self.__cancelled -= 1
+                    continue
+                if when > self.now() or (until is not None and when > until):
+                    return None, when
+                heapq.heappop(self.__queue)
+                timer.scheduler = None
+                return timer, when
+            return None, None
+
+    '''
+        Returns the next due event, or the time to wait until: None to wait for a wakeup,
+        or the stop marker when the horizon is reached
+    '''
+    def __next_step(self, until):
+        timer, when = self.__next_due(until)
+        if timer is not None:
+            return timer, when
+        if until is not None and (when is None or when > until):
+            if self.now() >= until:
+                return None, self.__STOP
+            return None, until
+        return None, when
+
+    '''
+        Runs an event holding the dispatch lock
+    '''
+    def __dispatch(self, timer):
+        with self.__dispatch_lock:
+            timer.callback(*timer.args)
+        self.event_count += 1
+
+    '''
+        Wakes up the running event loop, whichever kind it is, from any thread
+    '''
+    def __wake(self):
+        self.__wakeup.set()
+        loop = self.__loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.__async_wakeup.set)
+
+    '''
+        Runs the events in time order until the scheduler is stopped,
+        or until the given horizon (in clock time) is reached
+    '''
+    def run(self, until=None):
+        self.__running = True
+        try:
+            while self.__running:
+                self.__wakeup.clear()
+                timer, when = self.__next_step(until)
+                if timer is not None:
+                    self.__dispatch(timer)
+                elif when is self.__STOP:
+                    break
+                elif when is None:
+                    self.__wakeup.wait()
+                else:
+                    self.clock.wait_until(when, self.__wakeup)
+        finally:
+            self.__running = False
+
+    '''
+        Coroutine version of run, for asyncio event loops
+        Waiting never blocks the event loop, and cancelling the task stops the scheduler at once
+    '''
+    async def run_async(self, until=None):
+        self.__async_wakeup = asyncio.Event()
+        self.__loop = asyncio.get_running_loop()
+        self.__running = True
+        try:
+            while self.__running:
+                self.__async_wakeup.clear()
+                timer, when = self.__next_step(until)
+                if timer is not None:
+                    self.__dispatch(timer)
+                    if self.event_count % self.ASYNC_YIELD_INTERVAL == 0:
+                        await asyncio.sleep(0)
+                elif when is self.__STOP:
+                    break
+                elif when is None:
+                    await self.__async_wakeup.wait()
+                else:
+                    await self.clock.wait_until_async(when, self.__async_wakeup)
+        finally:
+            self.__running = False
+            self.__loop = None
+            self.__async_wakeup = None
+
+    '''
+        Stops the running event loop
+    '''
+    def stop(self):
+        self.__running = False
+        self.__wake()
@@ -0,0 +1,54 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+from smarthome.devices import *
+
+'''
+    Immutable state of a single device
+    Fields which do not apply to the type of the device are None
+'''
+DeviceState = namedtuple('DeviceState', ['id', 'type', 'name', 'status', 'brightness', 'temperature',
+                                         'desired_temp', 'security_status'])
+
+'''
+    Reads the current state of a device
+'''
+def device_state(device):
+    brightness = temperature = desired_temp = security_status = None
+    if isinstance(device, SmartLight):
+        brightness = device.get_brightness()
+    elif isinstance(device, Thermostat):
+        temperature = device.get_temperature()
+        desired_temp = device.get_desired_temp()
+    elif isinstance(device, SecurityCamera):
+        security_status = device.get_security_status()
+    return DeviceState(device.get_id(), type(device).__name__, device.get_name(), device.get_status(),
+                       brightness, temperature, desired_temp, security_status)
+
+'''
+    Immutable, versioned snapshot of every device of a home
+    Snapshots are never modified after they are created, so they can be read from any thread without locking
+'''
+class HomeSnapshot:
+    def __init__(self, version, time, devices):
+        self.version = version
+        self.time = time
+        self.devices = MappingProxyType(devices)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    '''
+        Returns the state of the device with the given id, None if there is no such device
+    '''
+    def get(self, device_id):
+        return self.devices.get(device_id)
+
+    '''
+        Returns the number of devices with the given power status
+    '''
+    def count(self, status):
+        return sum(1 for state in self.devices.values() if state.status == status)
@@ -0,0 +1,97 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+from smarthome.run import *
+
+'''
+    Parameter sweeps over many independent homes, sharded across a process pool
+
+    Usage: python -m smarthome.sweep scenario.json --homes N [--processes P] [--duration SECONDS] [--output FILE]
+'''
+
+'''
+    Runs a single home in a worker process
+    Scenarios are sent to the workers as dicts, so only plain data crosses the process boundary
+'''
+def run_home(data):
+    return run_scenario(scenario_from_dict(data))
+
+'''
+    Creates the scenarios of a sweep: one home for every seed and device mix
+'''
+def vary(base, seeds, device_mixes=None):
+    scenarios = []
+    for mix_index, devices in enumerate(device_mixes if device_mixes else [base.devices]):
+        for seed in seeds:
+            data = base.to_dict()
+            data['name'] = f'{base.name}#{mix_index}-{seed}'
+            data['devices'] = devices
+            data['seed'] = seed
+            scenarios.append(scenario_from_dict(data))
+    return scenarios
+
+'''
+    Runs the homes in a process pool, yielding the result of every home as soon as it is finished
+    The results come in completion order, not in the order of the scenarios
+'''
+def sweep(scenarios, processes=None, chunksize=1):
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(run_home, [scenario.to_dict() for scenario in scenarios], chunksize)
+
+'''
+    Aggregates the results of a sweep
+'''
+def aggregate(results):
+    events_per_second = [result['events_per_second'] for result in results if result['events_per_second']]
+    latencies = [result['rule_latency_us']['p99'] for result in results if result['rule_latency_us']['p99'] is not None]
+    return {
+        'homes': len(results),
+        'devices': sum(result['devices'] for result in results),
+        'events': sum(result['events'] for result in results),
+        'simulated_seconds': sum(result['simulated_seconds'] for result in results),
+        'home_wall_seconds': sum(result['wall_seconds'] for result in results),
+        'events_per_second_p50': percentile(events_per_second, 50),
+        'rule_latency_p99_us_p50': percentile(latencies, 50),
+        'devices_on_mean': sum(result['final_state']['devices_on'] for result in results) / len(results) if results else None,
+    }
+
+'''
+    Command line entry point
+    The per-home results are written as JSON lines, the aggregate is printed at the end
+'''
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m smarthome.sweep', description='Runs many independent homes in parallel.')
+    parser.add_argument('scenario', help='path of the JSON scenario file used for every home')
+    parser.add_argument('--homes', type=int, default=multiprocessing.cpu_count(), help='number of homes, seeded 0..N-1')
+    parser.add_argument('--processes', type=int, help='number of worker processes, defaults to the number of CPUs')
+    parser.add_argument('--duration', type=float, help='simulated seconds to run every home, overrides the scenario')
+    parser.add_argument('--output', help='file to write the per-home results to, as JSON lines')
+    args = parser.parse_args(argv)
+
+    try:
+        base = load_scenario(args.scenario)
+    except (OSError, ValueError, Scenario.InvalidScenario) as ex:
+        parser.error(str(ex))
+    if args.duration is not None:
+        base.duration = args.duration
+
+    results = []
+    wall_start = time.perf_counter()
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for result in sweep(vary(base, range(args.homes)), args.processes):
+            results.append(result)
+            if output:
+                output.write(json.dumps(result) + '\n')
+    finally:
+        if output:
+            output.close()
+
+    summary = aggregate(results)
+    summary['wall_seconds'] = time.perf_counter() - wall_start
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+from array import array
+import bisect
+from itertools import accumulate
+import threading
+
+from smarthome.rule_engine import *
+
+'''
+    Embedded time-series store of the telemetry of every device: every value change of every attribute
+
+    A series holds the changes of one attribute (status, brightness, temperature, desired_temp, security_status)
+    of one device. Times are stored in milliseconds and values as integers (levels, degrees, enumeration values).
+    Points are appended to an open chunk of columns; a full chunk is sealed: its times and values are delta-encoded
+    and stored in the narrowest integer array holding the differences, so a ramp takes about two bytes per point.
+    The chunks are indexed by their first time, a range query only decodes the chunks which overlap the range.
+    Every series also keeps 1 s, 1 min and 1 h rollups (min, max, average and count of the points of every bucket),
+    updated as the points arrive, so a long range can be read without touching the points at all.
+    Buckets without any point are left out. With time skipping, a ramp only records its final value.
+
+    Example: the temperature of device 42 over the last hour, by minute
+        store = TimeSeriesStore().attach(system)
+        rollup = store.last(42, 'temperature', 3600, TimeSeriesStore.MINUTE)
+'''
+
+'''
+    Array type codes of the signed integers, narrowest first, with their range
+'''
+PACKING = [('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63)]
+
+'''
+    Delta-encodes integers: returns the first integer, the type code of the narrowest array holding
+    the differences between the next ones and the bytes of that array
+'''
+def pack(values):
+    deltas = [value - previous for previous, value in zip(values, values[1:])]
+    low, high = min(deltas, default=0), max(deltas, default=0)
+    for typecode, bound in PACKING:
+        if -bound <= low and high < bound:
+            return values[0], typecode, array(typecode, deltas).tobytes()
+
+'''
+    Inverts pack
+'''
+def unpack(first, typecode, data):
+    return array('q', accumulate(array(typecode, data), initial=first))
+
+'''
+    Sealed chunk of a series: its delta-encoded times and values
+'''
+class Chunk:
+    __slots__ = ('start', 'end', 'count', 'times', 'values')
+
+    def __init__(self, times, values):
+        self.start = times[0]
+        self.end = times[-1]
+        self.count = len(times)
+        self.times = pack(times)
+        self.values = pack(values)
+
+    '''
+        Returns the times and values of the chunk
+    '''
+    def decode(self):
+        return unpack(*self.times), unpack(*self.values)
+
+'''
+    Rollup of a series at one resolution: a row per bucket with points
+    The open bucket is only appended to the rows when the next bucket opens, then merged into the coarser rollup,
+    so a point only updates the finest rollup and a coarser one is updated once per bucket of the finer one
+'''
+class Rollup:
+    __slots__ = ('resolution', 'coarser', 'starts', 'mins', 'maxs', 'sums', 'counts',
+                 'start', 'min', 'max', 'sum', 'count')
+
+    def __init__(self, resolution, coarser=None):
+        self.resolution = resolution
+        self.coarser = coarser
+        self.starts = array('q')
+        self.mins = array('q')
+        self.maxs = array('q')
+        self.sums = array('q')
+        self.counts = array('q')
+        self.start = None
+        self.min = self.max = self.sum = self.count = 0
+
+    def add(self, time, value):
+        self.merge(time, value, value, value, 1)
+
+    '''
+        Adds a bucket of a finer rollup (or a single point) starting at the given time
+    '''
+    def merge(self, time, low, high, total, count):
+        if self.start is not None and self.start <= time < self.start + self.resolution:
+            if low < self.min:
+                self.min = low
+            if high > self.max:
+                self.max = high
+            self.sum += total
+            self.count += count
+            return
+        if self.start is not None:
+            self.__close()
+        self.start = time - time % self.resolution
+        self.min = low
+        self.max = high
+        self.sum = total
+        self.count = count
+
+    def __close(self):
+        self.starts.append(self.start)
+        self.mins.append(self.min)
+        self.maxs.append(self.max)
+        self.sums.append(self.sum)
+        self.counts.append(self.count)
+        if self.coarser:
+            self.coarser.merge(self.start, self.min, self.max, self.sum, self.count)
+
+    '''
+        Returns the buckets which are not in the rows yet: the open bucket and the pending buckets
+        of the finer rollups (which have not been merged into this one yet), as tuples
+    '''
+    def pending(self, finer_pending=()):
+        buckets = [[self.start, self.min, self.max, self.sum, self.count]] if self.start is not None else []
+        for start, low, high, total, count in finer_pending:
+            start -= start % self.resolution
+            if buckets and buckets[-1][0] == start:
+                bucket = buckets[-1]
+                bucket[1] = min(bucket[1], low)
+                bucket[2] = max(bucket[2], high)
+                bucket[3] += total
+                bucket[4] += count
+            else:
+                buckets.append([start, low, high, total, count])
+        return buckets
+
+    '''
+        Returns the buckets starting in [start, end), the given pending ones included, as a RollupRange
+    '''
+    def range(self, start, end, pending):
+        first = bisect.bisect_left(self.starts, start)
+        last = bisect.bisect_left(self.starts, end)
+        starts, mins, maxs = self.starts[first:last], self.mins[first:last], self.maxs[first:last]
+        sums, counts = self.sums[first:last], self.counts[first:last]
+        for bucket in pending:
+            if start <= bucket[0] < end:
+                starts.append(bucket[0])
+                mins.append(bucket[1])
+                maxs.append(bucket[2])
+                sums.append(bucket[3])
+                counts.append(bucket[4])
+        return RollupRange(array('d', (bucket / 1000 for bucket in starts)), mins, maxs,
+                           array('d', (total / count for total, count in zip(sums, counts))), counts)
+
+'''
+    Buckets of a rollup returned by a query: parallel arrays of the start time (in seconds) of every bucket,
+    and the min, max, average and count of its points
+'''
+class RollupRange:
+    def __init__(self, times, mins, maxs, avgs, counts):
+        self.times = times
+        self.mins = mins
+        self.maxs = maxs
+        self.avgs = avgs
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.times)
+
+'''
+    Changes of one attribute of one device
+'''
+class Series:
+    __slots__ = ('chunks', 'starts', 'times', 'values', 'rollups')
+
+    '''
+        The resolutions of the rollups have to be multiples of each other, finest first
+    '''
+    def __init__(self, resolutions):
+        self.chunks = []
+        self.starts = []
+        self.times = array('q')
+        self.values = array('q')
+        rollups = []
+        for resolution in reversed(resolutions):
+            rollups.insert(0, Rollup(resolution, rollups[0] if rollups else None))
+        self.rollups = tuple(rollups)
+
+    def __len__(self):
+        return sum(chunk.count for chunk in self.chunks) + len(self.times)
+
+    def append(self, time, value, chunk_size):
+        self.times.append(time)
+        self.values.append(value)
+        self.rollups[0].add(time, value)
+        if len(self.times) >= chunk_size:
+            chunk = Chunk(self.times, self.values)
+            self.chunks.append(chunk)
+            self.starts.append(chunk.start)
+            self.times = array('q')
+            self.values = array('q')
+
+    '''
+        Returns the times and values of the points in [start, end)
+    '''
+    def range(self, start, end):
+        times = array('q')
+        values = array('q')
+        first = max(0, bisect.bisect_right(self.starts, start) - 1)
+        last = bisect.bisect_left(self.starts, end)
+        for chunk in self.chunks[first:last]:
+            if chunk.end < start:
+                continue
+            chunk_times, chunk_values = chunk.decode()
+            low = bisect.bisect_left(chunk_times, start)
+            high = bisect.bisect_left(chunk_times, end)
+            times.extend(chunk_times[low:high])
+            values.extend(chunk_values[low:high])
+        low = bisect.bisect_left(self.times, start)
+        high = bisect.bisect_left(self.times, end)
+        times.extend(self.times[low:high])
+        values.extend(self.values[low:high])
+        return times, values
+
+    '''
+        Returns the rollup with the given index in [start, end), as a RollupRange
+    '''
+    def rollup(self, index, start, end):
+        pending = ()
+        for rollup in self.rollups[:index + 1]:
+            pending = rollup.pending(pending)
+        rollup = self.rollups[index]
+        return rollup.range(start - start % rollup.resolution, end, pending)
+
+'''
+    Time-series store of the attributes of the devices of a system
+'''
+class TimeSeriesStore:
+    '''
+        Exception which can be raised when an unknown attribute or resolution is queried
+    '''
+    class UnknownSeries(Exception):
+        def __init__(self, msg):
+            super().__init__(msg)
+
+    SECOND = 1
+    MINUTE = 60
+    HOUR = 3600
+    RESOLUTIONS = (SECOND, MINUTE, HOUR)
+    DEFAULT_CHUNK_SIZE = 256
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.__chunk_size = max(chunk_size, 1)
+        self.__resolutions = tuple(resolution * 1000 for resolution in self.RESOLUTIONS)
+        self.__series = {}
+        self.__lock = threading.Lock()
+        self.__system = None
+
+    def __len__(self):
+        with self.__lock:
+            return sum(len(series) for series in self.__series.values())
+
+    '''
+        Starts recording the state changes of a system, from the current state of its devices on
+        Returns the store
+    '''
+    def attach(self, system):
+        with system.lock:
+            self.__system = system
+            now = system.clock.now()
+            for state in system.snapshot():
+                for attribute in ATTRIBUTE_EVENTS:
+                    value = getattr(state, attribute)
+                    if value is not None:
+                        self.record(state.id, attribute, now, value)
+            for event_type in EVENT_ATTRIBUTES:
+                system.events.subscribe(event_type, self.record_state_change)
+        return self
+
+    '''
+        Stops recording the state changes of the attached system
+    '''
+    def detach(self):
+        if self.__system is None:
+            return
+        for event_type in EVENT_ATTRIBUTES:
+            self.__system.events.unsubscribe(event_type, self.record_state_change)
+        self.__system = None
+
+    '''
+        Records a state change published by the system
+    '''
+    def record_state_change(self, event):
+        self.record(event.device.get_id(), EVENT_ATTRIBUTES[event.event_type], event.time, event.value)
+
+    '''
+        Records the value of an attribute of a device at the given time (in seconds)
+        The points of a series have to be recorded in time order
+    '''
+    def record(self, device_id, attribute, time, value):
+        with self.__lock:
+            series = self.__series.get((device_id, attribute))
+            if series is None:
+                series = self.__series[(device_id, attribute)] = Series(self.__resolutions)
+            series.append(round(time * 1000), int(value), self.__chunk_size)
+
+    '''
+        Returns the ids of the devices and the attributes of every series
+    '''
+    def series(self):
+        with self.__lock:
+            return list(self.__series)
+
+    '''
+        Returns the times (in seconds) and the values of the changes of an attribute of a device in [start, end),
+        as two arrays; without a start or an end the range is not limited on that side
+    '''
+    def query(self, device_id, attribute, start=None, end=None):
+        series = self.__get(device_id, attribute)
+        with self.__lock:
+            if series is None:
+                return array('d'), array('q')
+            times, values = series.range(*self.__bounds(start, end))
+        return array('d', (time / 1000 for time in times)), values
+
+    '''
+        Returns the rollup of an attribute of a device at a resolution (in seconds, one of RESOLUTIONS),
+        for the buckets starting in [start, end), as a RollupRange
+    '''
+    def rollup(self, device_id, attribute, resolution, start=None, end=None):
+        if resolution not in self.RESOLUTIONS:
+            raise self.UnknownSeries(f'Resolution must be one of {", ".join(map(str, self.RESOLUTIONS))} seconds')
+        series = self.__get(device_id, attribute)
+        with self.__lock:
+            if series is None:
+                return Rollup(resolution).range(0, 0, ())
+            return series.rollup(self.RESOLUTIONS.index(resolution), *self.__bounds(start, end))
+
+    '''
+        Returns the changes of an attribute of a device in the given number of seconds up to now,
+        or their rollup if a resolution is given
+    '''
+    def last(self, device_id, attribute, seconds, resolution=None):
+        if self.__system is None:
+            raise self.UnknownSeries('The store is not attached to a system')
+        now = self.__system.clock.now()
+        if resolution is None:
+            return self.query(device_id, attribute, now - seconds)
+        return self.rollup(device_id, attribute, resolution, now - seconds)
+
+    def __get(self, device_id, attribute):
+        if attribute not in ATTRIBUTE_EVENTS:
+            raise self.UnknownSeries(f'Unknown attribute: {attribute}')
+        with self.__lock:
+            return self.__series.get((device_id, attribute))
+
+    '''
+        Returns a range in seconds as a range in milliseconds, not limited on the sides without a bound
+    '''
+    def __bounds(self, start, end):
+        return (round(start * 1000) if start is not None else -(1 << 62),
+                round(end * 1000) if end is not None else 1 << 62)